@@ -0,0 +1,181 @@
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any
+
+import zstandard
+from langchain_core.messages import ToolMessage
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from app.core.config import settings
+from app.services.metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+# Суффикс типа блоба, сжатого zstd. Несжатые блобы читаются как раньше
+ZSTD_SUFFIX = "+zstd"
+
+# Счетчик байт текущего чекпоинта. Сериализация идет в asyncio.to_thread,
+# который копирует контекст, поэтому счетчик виден и из потока
+_checkpoint_bytes: ContextVar[list[int] | None] = ContextVar(
+    "checkpoint_bytes", default=None
+)
+
+
+def create_checkpointer_pool() -> AsyncConnectionPool:
+    """
+    Пул соединений Postgres для AsyncPostgresSaver.
+
+    Каждое соединение проверяется перед выдачей (check_connection), поэтому
+    оборванное соединение заменяется новым, а не роняет агента до рестарта.
+    """
+    return AsyncConnectionPool(
+        conninfo=settings.POSTGRES_DB_URL,
+        min_size=settings.CHECKPOINT_POOL_MIN_SIZE,
+        max_size=settings.CHECKPOINT_POOL_MAX_SIZE,
+        max_idle=settings.CHECKPOINT_POOL_MAX_IDLE,
+        timeout=settings.CHECKPOINT_POOL_TIMEOUT,
+        check=AsyncConnectionPool.check_connection,
+        name="checkpointer",
+        open=False,
+        # Эти параметры соединения обязательны для AsyncPostgresSaver
+        kwargs={
+            "autocommit": True,
+            "prepare_threshold": 0,
+            "row_factory": dict_row,
+            "options": f"-c statement_timeout={settings.CHECKPOINT_STATEMENT_TIMEOUT_MS}",
+        },
+    )
+
+
+class CompactSerializer(JsonPlusSerializer):
+    """
+    Сериализатор чекпоинтов: убирает artifact из ToolMessage (документы
+    retrieve_docs уже есть в тексте сообщения) и сжимает крупные блобы zstd.
+    """
+
+    def __init__(
+        self,
+        compression_min_bytes: int,
+        compression_level: int,
+        strip_artifacts: bool = True,
+    ):
+        super().__init__()
+        self.compression_min_bytes = compression_min_bytes
+        self.compression_level = compression_level
+        self.strip_artifacts = strip_artifacts
+
+        self._lock = threading.Lock()
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.stripped_artifacts = 0
+        self.checkpoints = 0
+        self.checkpoint_bytes_total = 0
+        self.checkpoint_bytes_max = 0
+
+    def _strip(self, obj: Any) -> Any:
+        if isinstance(obj, ToolMessage) and obj.artifact is not None:
+            with self._lock:
+                self.stripped_artifacts += 1
+            return obj.model_copy(update={"artifact": None})
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._strip(item) for item in obj)
+        return obj
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        if self.strip_artifacts:
+            obj = self._strip(obj)
+        type_, data = super().dumps_typed(obj)
+        raw_size = len(data)
+
+        if raw_size >= self.compression_min_bytes:
+            compressed = zstandard.compress(data, self.compression_level)
+            if len(compressed) < raw_size:
+                type_, data = f"{type_}{ZSTD_SUFFIX}", compressed
+
+        with self._lock:
+            self.raw_bytes += raw_size
+            self.stored_bytes += len(data)
+        if (counter := _checkpoint_bytes.get()) is not None:
+            counter[0] += len(data)
+        return type_, data
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.endswith(ZSTD_SUFFIX):
+            type_ = type_.removesuffix(ZSTD_SUFFIX)
+            payload = zstandard.decompress(payload)
+        return super().loads_typed((type_, payload))
+
+    def record_checkpoint(self, size: int) -> None:
+        with self._lock:
+            self.checkpoints += 1
+            self.checkpoint_bytes_total += size
+            self.checkpoint_bytes_max = max(self.checkpoint_bytes_max, size)
+
+    def stats(self) -> dict:
+        return {
+            "checkpoints": self.checkpoints,
+            "avg_checkpoint_bytes": (
+                self.checkpoint_bytes_total / self.checkpoints
+                if self.checkpoints
+                else 0.0
+            ),
+            "max_checkpoint_bytes": self.checkpoint_bytes_max,
+            "raw_bytes": self.raw_bytes,
+            "stored_bytes": self.stored_bytes,
+            "compression_ratio": (
+                self.raw_bytes / self.stored_bytes if self.stored_bytes else 1.0
+            ),
+            "stripped_artifacts": self.stripped_artifacts,
+        }
+
+
+class CompactPostgresSaver(AsyncPostgresSaver):
+    """
+    AsyncPostgresSaver, который считает, сколько байт блобов записано на чекпоинт,
+    и замеряет чтение и запись чекпоинтов
+    """
+
+    serde: CompactSerializer
+
+    async def aget_tuple(self, config):
+        with track_stage("checkpoint_read"):
+            return await super().aget_tuple(config)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        with track_stage("checkpoint_write"):
+            await super().aput_writes(config, writes, task_id, task_path)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        counter = [0]
+        token = _checkpoint_bytes.set(counter)
+        try:
+            with track_stage("checkpoint_write"):
+                next_config = await super().aput(
+                    config, checkpoint, metadata, new_versions
+                )
+        finally:
+            _checkpoint_bytes.reset(token)
+
+        self.serde.record_checkpoint(counter[0])
+        logger.debug(
+            f"Checkpoint {checkpoint['id']} for thread "
+            f"{config['configurable']['thread_id']}: {counter[0]} bytes"
+        )
+        return next_config
+
+
+def create_serializer() -> CompactSerializer:
+    return CompactSerializer(
+        compression_min_bytes=settings.CHECKPOINT_COMPRESSION_MIN_BYTES,
+        compression_level=settings.CHECKPOINT_COMPRESSION_LEVEL,
+        strip_artifacts=settings.CHECKPOINT_STRIP_ARTIFACTS,
+    )
+
+
+def create_checkpointer(pool: AsyncConnectionPool) -> CompactPostgresSaver:
+    return CompactPostgresSaver(pool, serde=create_serializer())
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -6,7 +8,8 @@ class Settings(BaseSettings):
 
     OPENAI_API_KEY: str
 
-    BOT_TOKEN: str
+    # Нужен только процессу бота
+    BOT_TOKEN: str | None = None
 
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
@@ -14,6 +17,29 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str
     POSTGRES_PORT: int
 
+    # Пул соединений для чекпоинтера LangGraph
+    CHECKPOINT_POOL_MIN_SIZE: int = 2
+    CHECKPOINT_POOL_MAX_SIZE: int = 10
+    CHECKPOINT_POOL_MAX_IDLE: float = 300.0  # секунды
+    CHECKPOINT_POOL_TIMEOUT: float = 10.0  # ожидание свободного соединения, секунды
+    CHECKPOINT_STATEMENT_TIMEOUT_MS: int = 15000
+    # Блобы чекпоинтов больше этого размера сжимаются zstd
+    CHECKPOINT_COMPRESSION_MIN_BYTES: int = 1024
+    CHECKPOINT_COMPRESSION_LEVEL: int = 3
+    # Не сохранять artifact ответов инструментов (документы retrieve_docs)
+    CHECKPOINT_STRIP_ARTIFACTS: bool = True
+
+    # Чистка таблиц чекпоинтера, 0 - фоновая задача выключена
+    CHECKPOINT_RETENTION_INTERVAL: float = 60 * 60  # секунды
+    # Сколько последних чекпоинтов оставлять в каждом треде
+    CHECKPOINT_KEEP_LAST: int = 3
+    # Удалять треды без активности дольше этого срока, None - не удалять
+    CHECKPOINT_THREAD_TTL: float | None = None  # секунды
+    # Не трогать треды, в которые писали недавно
+    CHECKPOINT_RETENTION_MIN_IDLE: float = 10 * 60  # секунды
+    CHECKPOINT_RETENTION_BATCH_SIZE: int = 200  # тредов в одной транзакции
+    CHECKPOINT_RETENTION_LOCK_TIMEOUT_MS: int = 2000
+
     QDRANT_HOST: str
     QDRANT_HOST_OFFLINE: str = "localhost"
     QDRANT_PORT: int
@@ -21,16 +47,109 @@ class Settings(BaseSettings):
 
     VECTOR_NAME: str = "dense"
     SPARSE_VECTOR_NAME: str = "sparce"
+    # Профиль коллекции из app/core/qdrant_profiles.py: default, balanced, low_memory
+    QDRANT_PROFILE: str = "default"
+
+    # Параметры поиска retrieve_docs
+    RETRIEVAL_K: int = 4
+    # Кандидатов из dense и sparse поиска до слияния
+    RETRIEVAL_FETCH_K: int = 10
+    # Минимальное косинусное сходство dense кандидатов, None - без отсечения
+    RETRIEVAL_SCORE_THRESHOLD: float | None = None
+    RETRIEVAL_FUSION: Literal["rrf", "dbsf"] = "rrf"
+    # Лимит контекста, который получает модель, None - без лимита
+    RETRIEVAL_MAX_CONTEXT_CHARS: int | None = 4000
+
+    # Переранжирование кандидатов кросс-энкодером (fastembed, CPU)
+    RERANK_ENABLED: bool = False
+    # Уроки на русском и корейском, поэтому мультиязычная модель. Маленькие
+    # кросс-энкодеры fastembed (MiniLM, jina v1 tiny/turbo) только английские
+    RERANK_MODEL: str = "jinaai/jina-reranker-v2-base-multilingual"
+    # Сколько кандидатов гибридного поиска переранжировать
+    RERANK_CANDIDATES: int = 12
+    # Сколько лучших чанков после переранжирования получает модель
+    RERANK_TOP_N: int = 2
+    RERANK_BATCH_SIZE: int = 16
+    # Бюджет задержки, после которого остается порядок гибридного поиска.
+    # Base модель (~1 ГБ) на CPU оценивает 12 кандидатов дольше 0.5с. Прогрев замеряет
+    # оценку RERANK_CANDIDATES кандидатов и пишет в лог, если она не укладывается
+    RERANK_TIMEOUT: float = 2.0  # секунды
+    RERANK_THREADS: int | None = None
+
+    # tool - модель сама вызывает retrieve_docs (HyDE в системном промпте),
+    # pre_retrieval - поиск до вызова модели, ответ за один вызов LLM
+    AGENT_MODE: Literal["tool", "pre_retrieval"] = "tool"
+    # В режиме pre_retrieval дополнительно искать по гипотетическому ответу
+    PRE_RETRIEVAL_HYDE: bool = False
+    HYDE_MODEL: str = "gpt-4o-mini"
+    HYDE_MAX_TOKENS: int = 150
+
+    # Бюджет токенов истории чата перед вызовом модели
+    HISTORY_MAX_TOKENS: int = 3000
+    # Сворачивать отброшенную часть истории в краткое содержание
+    HISTORY_SUMMARY_ENABLED: bool = False
+    HISTORY_SUMMARY_MODEL: str = "gpt-4o-mini"
+    HISTORY_SUMMARY_MAX_TOKENS: int = 300
 
-    LANGSMITH_API_KEY: str
+    # Прогрев зависимостей в lifespan до приема трафика
+    WARMUP_ENABLED: bool = True
+    # Прогрев делает один платный запрос эмбеддинга к OpenAI при каждом запуске
+    # процесса (каждого воркера), поэтому включается только в деплое
+    WARMUP_OPENAI: bool = False
+    WARMUP_TIMEOUT: float = 30.0  # секунды на каждый шаг
+    READINESS_PROBE_TIMEOUT: float = 2.0  # секунды
+
+    # Трейсинг LangSmith выключен в проде, ключ необязателен
+    LANGSMITH_API_KEY: str | None = None
     LANGSMITH_TRACING: bool = False
 
     VECTOR_STORE_PATH: str = "qdrant_data"
     # SOURCE_DOCS_PATH: str = "source_docs"
 
+    # Транскрибация голосовых (OpenAI Whisper)
+    TRANSCRIPTION_MODEL: str = "whisper-1"
+    TRANSCRIPTION_TIMEOUT: float = 30.0  # секунды
+    TRANSCRIPTION_MAX_RETRIES: int = 2
+    TRANSCRIPTION_MAX_CONNECTIONS: int = 20
+    AUDIO_MAX_SIZE_BYTES: int = 25 * 1024 * 1024  # лимит Whisper API
+    TRANSCRIPT_CACHE_SIZE: int = 1024
+    # Дополнительно хранить транскрипции в таблице transcripts
+    TRANSCRIPT_CACHE_PERSISTENT: bool = False
+
+    # Предобработка изображений перед vision моделью
+    IMAGE_MAX_SIDE: int = 1536
+    # Картинки не больше этого размера отправляются с detail=low
+    IMAGE_LOW_DETAIL_MAX_SIDE: int = 512
+    IMAGE_JPEG_QUALITY: int = 85
+
     EMBEDDING_MODEL: str = "text-embedding-3-small"
     SPARSE_MODEL: str = "Qdrant/bm25"
 
+    # Кэш эмбеддингов поисковых запросов
+    EMBEDDING_CACHE_SIZE: int = 4096
+    EMBEDDING_CACHE_TTL: float | None = 24 * 60 * 60  # секунды
+    # Дополнительно хранить эмбеддинги в таблице embedding_cache
+    EMBEDDING_CACHE_PERSISTENT: bool = False
+
+    # Пакетная запись логов диалогов
+    CHAT_LOG_BATCH_SIZE: int = 100
+    CHAT_LOG_FLUSH_INTERVAL: float = 1.0  # секунды
+    CHAT_LOG_QUEUE_SIZE: int = 10000
+
+    # Семантический кэш ответов на первые текстовые вопросы
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_SIZE: int = 2048
+    ANSWER_CACHE_TTL: float = 24 * 60 * 60  # секунды
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+    # Как часто проверять, не загружены ли уроки в Qdrant заново
+    ANSWER_CACHE_VERSION_CHECK_INTERVAL: float = 60.0  # секунды
+
+    # Одновременные сообщения одного треда: queue - ходы агента по очереди,
+    # merge - сообщения, пришедшие за CHAT_MERGE_WINDOW, объединяются в один ход
+    CHAT_CONCURRENCY_POLICY: Literal["queue", "merge"] = "queue"
+    CHAT_MERGE_WINDOW: float = 1.5  # секунды
+    CHAT_MERGE_MAX_MESSAGES: int = 5
+
     model_config = SettingsConfigDict(
         env_file="app/.env", env_file_encoding="utf-8", extra="ignore"
     )
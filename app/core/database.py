@@ -1,13 +1,27 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from functools import lru_cache
+
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import DeclarativeBase
 from app.core.config import settings
 
 
-engine = create_async_engine(settings.DATABASE_URL, future=True)
+# Движок создается при первом обращении, а не при импорте моделей
+# (alembic, скрипты и бот импортируют Base без подключения к бд)
+@lru_cache
+def get_engine() -> AsyncEngine:
+    return create_async_engine(settings.DATABASE_URL, future=True)
 
-AsyncSessionLocal = async_sessionmaker(
-    bind=engine, class_=AsyncSession, expire_on_commit=False, autoflush=False
-)
+
+@lru_cache
+def get_session_factory() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(
+        bind=get_engine(), class_=AsyncSession, expire_on_commit=False, autoflush=False
+    )
 
 
 class Base(DeclarativeBase):
@@ -15,7 +29,7 @@ class Base(DeclarativeBase):
 
 
 async def get_db():
-    async with AsyncSessionLocal() as session:
+    async with get_session_factory()() as session:
         try:
             yield session
         finally:
@@ -0,0 +1,121 @@
+from dataclasses import dataclass, field
+from typing import Literal
+
+from qdrant_client import models
+
+# Ключ в metadata коллекции Qdrant, который меняется при каждой новой загрузке уроков.
+# Пишет offline_vector_ingestion.py, читает кэш ответов
+COLLECTION_VERSION_KEY = "version"
+
+
+@dataclass(frozen=True)
+class QdrantProfile:
+    """
+    Профиль настройки коллекции Qdrant.
+
+    Одни и те же параметры используются при создании коллекции
+    (offline_vector_ingestion.py) и при поиске (retrieve_docs), чтобы
+    hnsw_ef и oversampling соответствовали тому, как построен индекс.
+    """
+
+    quantization: Literal["none", "scalar", "binary"] = "none"
+    # Держать квантованные векторы в RAM, а полные - на диске для rescoring
+    quantization_always_ram: bool = True
+    hnsw_m: int | None = None
+    hnsw_ef_construct: int | None = None
+    on_disk_vectors: bool = False
+    on_disk_payload: bool = False
+    on_disk_sparse_index: bool = False
+    # Поле payload -> тип индекса, например {"metadata.source": "keyword"}
+    payload_indexes: dict[str, str] = field(default_factory=dict)
+
+    # Параметры поиска
+    hnsw_ef: int | None = None
+    rescore: bool = True
+    oversampling: float | None = None
+
+    def vector_params(self, size: int) -> models.VectorParams:
+        return models.VectorParams(
+            size=size,
+            distance=models.Distance.COSINE,
+            on_disk=self.on_disk_vectors or None,
+            hnsw_config=self.hnsw_config(),
+            quantization_config=self.quantization_config(),
+        )
+
+    def sparse_vector_params(self) -> models.SparseVectorParams:
+        return models.SparseVectorParams(
+            modifier=models.Modifier.IDF,
+            index=models.SparseIndexParams(on_disk=self.on_disk_sparse_index),
+        )
+
+    def hnsw_config(self) -> models.HnswConfigDiff | None:
+        if self.hnsw_m is None and self.hnsw_ef_construct is None:
+            return None
+        return models.HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct)
+
+    def quantization_config(self) -> models.QuantizationConfig | None:
+        if self.quantization == "scalar":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=self.quantization_always_ram,
+                )
+            )
+        if self.quantization == "binary":
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(
+                    always_ram=self.quantization_always_ram
+                )
+            )
+        return None
+
+    def search_params(self) -> models.SearchParams | None:
+        """Параметры dense поиска: размер кандидатов HNSW и rescoring квантованных векторов"""
+        quantization = None
+        if self.quantization != "none":
+            quantization = models.QuantizationSearchParams(
+                rescore=self.rescore, oversampling=self.oversampling
+            )
+        if self.hnsw_ef is None and quantization is None:
+            return None
+        return models.SearchParams(hnsw_ef=self.hnsw_ef, quantization=quantization)
+
+
+QDRANT_PROFILES: dict[str, QdrantProfile] = {
+    # Как раньше: полные float32 векторы и индексы в памяти
+    "default": QdrantProfile(),
+    # int8 квантование: в RAM ~в 4 раза меньше, точность восстанавливается rescoring
+    "balanced": QdrantProfile(
+        quantization="scalar",
+        hnsw_m=16,
+        hnsw_ef_construct=200,
+        on_disk_vectors=True,
+        on_disk_payload=True,
+        payload_indexes={"metadata.source": "keyword"},
+        hnsw_ef=128,
+        oversampling=2.0,
+    ),
+    # Бинарное квантование: в RAM ~в 32 раза меньше, нужен больший oversampling
+    "low_memory": QdrantProfile(
+        quantization="binary",
+        hnsw_m=16,
+        hnsw_ef_construct=100,
+        on_disk_vectors=True,
+        on_disk_payload=True,
+        on_disk_sparse_index=True,
+        payload_indexes={"metadata.source": "keyword"},
+        hnsw_ef=128,
+        oversampling=3.0,
+    ),
+}
+
+
+def get_qdrant_profile(name: str) -> QdrantProfile:
+    try:
+        return QDRANT_PROFILES[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown Qdrant profile '{name}', expected one of {list(QDRANT_PROFILES)}"
+        )
@@ -1,13 +1,30 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, status, Security, Depends
 from fastapi.security import APIKeyHeader
-from langgraph.checkpoint.postgres import PostgresSaver
+from qdrant_client import AsyncQdrantClient, QdrantClient
 
+from app.core.checkpointer import create_checkpointer, create_checkpointer_pool
 from app.core.config import settings
-from app.services.agent.rag_agent import build_rag_agent
-from app.routers import chat, health
+from app.core.database import get_engine, get_session_factory
+from app.services.agent.audio import create_transcription_service
+from app.services.agent.image import create_vision_model
+from app.services.agent.rerank import create_reranker
+from app.services.answer_cache import AnswerCache
+from app.services.chat_turns import create_chat_turn_controller
+from app.services.checkpoint_retention import create_checkpoint_retention
+from app.services.db_service import ChatLogWriter
+from app.services.metrics import MetricsMiddleware
+from app.services.readiness import warmup
+from app.services.agent.rag_agent import (
+    build_rag_agent,
+    create_chat_model,
+    create_embeddings,
+    get_vector_store,
+)
+from app.routers import chat, health, metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,13 +43,90 @@ async def verify_api_key(api_key: str = Security(api_key_header)):
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    with PostgresSaver.from_conn_string(settings.POSTGRES_DB_URL) as checkpointer:
-        checkpointer.setup()
-        app.state.rag_agent = build_rag_agent(checkpointer)
-        yield
+    async with create_checkpointer_pool() as pool:
+        checkpointer = create_checkpointer(pool)
+        await checkpointer.setup()
+        app.state.checkpointer_pool = pool
+        app.state.checkpointer = checkpointer
+        app.state.checkpoint_retention = create_checkpoint_retention(pool)
+        if settings.CHECKPOINT_RETENTION_INTERVAL > 0:
+            app.state.checkpoint_retention.start()
+        app.state.qdrant_client = AsyncQdrantClient(
+            host=settings.QDRANT_HOST, port=settings.QDRANT_PORT
+        )
+        # Загрузка ONNX моделей (BM25 и кросс-энкодер) блокирующая,
+        # выносим из event loop и загружаем параллельно
+        (embeddings, sparse_embeddings), app.state.reranker = await asyncio.gather(
+            asyncio.to_thread(create_embeddings),
+            asyncio.to_thread(create_reranker),
+        )
+        app.state.embeddings = embeddings
+        app.state.sparse_embeddings = sparse_embeddings
+        app.state.chat_model = create_chat_model()
+        app.state.vision_model = create_vision_model()
+        vector_store = get_vector_store(
+            QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT),
+            embeddings,
+            sparse_embeddings,
+        )
+        app.state.rag_agent = build_rag_agent(
+            checkpointer,
+            app.state.qdrant_client,
+            vector_store,
+            app.state.chat_model,
+            reranker=app.state.reranker,
+        )
+        app.state.transcription_service = create_transcription_service()
+        app.state.caches = {
+            "transcripts": app.state.transcription_service.cache,
+            "query_embeddings_dense": embeddings.cache,
+            "query_embeddings_sparse": sparse_embeddings.cache,
+        }
+        if settings.ANSWER_CACHE_ENABLED:
+            app.state.answer_cache = AnswerCache(
+                embeddings=embeddings,
+                qdrant_client=app.state.qdrant_client,
+                collection_name=settings.QDRANT_COLLECTION_NAME,
+                max_size=settings.ANSWER_CACHE_SIZE,
+                ttl=settings.ANSWER_CACHE_TTL,
+                threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                version_check_interval=settings.ANSWER_CACHE_VERSION_CHECK_INTERVAL,
+            )
+            app.state.caches["answers"] = app.state.answer_cache
+        app.state.chat_log_writer = ChatLogWriter(
+            session_factory=get_session_factory(),
+            batch_size=settings.CHAT_LOG_BATCH_SIZE,
+            flush_interval=settings.CHAT_LOG_FLUSH_INTERVAL,
+            max_queue_size=settings.CHAT_LOG_QUEUE_SIZE,
+        )
+        app.state.chat_log_writer.start()
+        app.state.turn_controller = create_chat_turn_controller()
+        if settings.WARMUP_ENABLED:
+            app.state.warmup = await warmup(
+                pool,
+                app.state.qdrant_client,
+                embeddings.embeddings,
+                sparse_embeddings.sparse_embeddings,
+                reranker=app.state.reranker,
+            )
+        app.state.ready = True
+        try:
+            yield
+        finally:
+            app.state.ready = False
+            await app.state.turn_controller.close()
+            await app.state.checkpoint_retention.close()
+            await app.state.chat_log_writer.close()
+            await app.state.transcription_service.close()
+            await app.state.qdrant_client.close()
+            if app.state.reranker:
+                app.state.reranker.close()
+            await get_engine().dispose()
 
 
 app = FastAPI(title="Тестовое", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(health.router)
+app.include_router(metrics.router)
 app.include_router(chat.router, dependencies=[Depends(verify_api_key)])
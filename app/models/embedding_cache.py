@@ -0,0 +1,19 @@
+from datetime import datetime
+from sqlalchemy import String, DateTime, JSON
+from sqlalchemy.orm import Mapped, mapped_column
+from app.core.database import Base
+
+
+class EmbeddingCacheEntry(Base):
+    __tablename__ = "embedding_cache"
+
+    # sha256 от "<namespace>:<нормализованный текст>"
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[dict | list] = mapped_column(JSON)
+    # Индекс для удаления устаревших записей (PersistentCacheStore.prune)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.now, index=True
+    )
+
+    def __repr__(self):
+        return f"<EmbeddingCacheEntry(key={self.key})>"
@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import NotRequired
 
 from langchain.agents import AgentState
 from pydantic import BaseModel
@@ -6,6 +7,8 @@ from pydantic import BaseModel
 
 class CustomAgentState(AgentState):
     user_id: str
+    # Краткое содержание отброшенной части истории (create_trim_messages)
+    summary: NotRequired[str]
 
 
 class ChatRequest(BaseModel):
@@ -16,6 +19,9 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     user_id: str
     response: str
+    # Сообщение объединено с более поздним (политика merge): ответ пустой,
+    # он придет на запрос последнего сообщения
+    merged: bool = False
 
 
 class UserRequestType(str, Enum):
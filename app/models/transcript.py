@@ -0,0 +1,16 @@
+from datetime import datetime
+from sqlalchemy import Text, String, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+from app.core.database import Base
+
+
+class Transcript(Base):
+    __tablename__ = "transcripts"
+
+    # sha256 содержимого или tg:<file_unique_id>
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)
+    text: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+    def __repr__(self):
+        return f"<Transcript(key={self.key})>"
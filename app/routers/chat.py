@@ -1,32 +1,46 @@
 import logging
+from typing import AsyncIterator
+
 from fastapi import (
     APIRouter,
     Request,
     HTTPException,
     Depends,
-    BackgroundTasks,
     UploadFile,
     File,
     Form,
 )
+from fastapi.responses import StreamingResponse
 
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
 from langgraph.graph.state import CompiledStateGraph
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.database import get_db
+from app.core.prompts import IMAGE_BLOCK
 from app.models.schemas import (
     ChatResponse,
     UserRequestType,
 )
-from app.services.agent.audio import transcribe_audio
-from app.services.agent.image import encode_image
+from app.services.agent.audio import TranscriptionService
+from app.services.agent.image import describe_image
+from app.services.agent.streaming import format_sse, stream_agent_events
 from app.services.agent.tools.messages import delete_all_messages
-from app.services.db_service import log_interaction
+from app.services.answer_cache import AnswerCache
+from app.services.chat_turns import (
+    ChatTurnController,
+    TurnEvent,
+    TurnMessage,
+    TurnRunner,
+)
+from app.services.db_service import ChatLogWriter
+from app.services.metrics import track_stage
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/chat")
 
+IMAGE_ONLY_PROMPT = "Ответь на запрос пользователя, в зависимости от картинки"
+
 
 # DI для получения агента
 def get_agent(request: Request) -> CompiledStateGraph:
@@ -35,94 +49,289 @@ def get_agent(request: Request) -> CompiledStateGraph:
     return request.app.state.rag_agent
 
 
+# DI для сервиса транскрибации
+def get_transcription_service(request: Request) -> TranscriptionService:
+    if not hasattr(request.app.state, "transcription_service"):
+        raise HTTPException(
+            status_code=500, detail="Transcription service not initialized"
+        )
+    return request.app.state.transcription_service
+
+
+# DI для vision модели, которая описывает картинки
+def get_vision_model(request: Request) -> BaseChatModel:
+    if not hasattr(request.app.state, "vision_model"):
+        raise HTTPException(status_code=500, detail="Vision model not initialized")
+    return request.app.state.vision_model
+
+
+# DI для записи логов диалогов
+def get_chat_log_writer(request: Request) -> ChatLogWriter:
+    if not hasattr(request.app.state, "chat_log_writer"):
+        raise HTTPException(status_code=500, detail="Chat log writer not initialized")
+    return request.app.state.chat_log_writer
+
+
+# DI для очереди ходов агента по тредам
+def get_turn_controller(request: Request) -> ChatTurnController:
+    if not hasattr(request.app.state, "turn_controller"):
+        raise HTTPException(status_code=500, detail="Turn controller not initialized")
+    return request.app.state.turn_controller
+
+
+# DI для кэша ответов (None, если кэш выключен)
+def get_answer_cache(request: Request) -> AnswerCache | None:
+    return getattr(request.app.state, "answer_cache", None)
+
+
+async def _lookup_cached_answer(
+    answer_cache: AnswerCache | None,
+    agent: CompiledStateGraph,
+    config: dict,
+    question: str | None,
+    request_type: UserRequestType,
+) -> tuple[bool, str | None]:
+    """
+    Кэш ответов используется только для текстовых вопросов в начале диалога,
+    когда ответ не зависит от истории.
+
+    Возвращает (можно ли положить ответ в кэш, ответ из кэша)
+    """
+    if answer_cache is None or request_type != UserRequestType.text or not question:
+        return False, None
+
+    state = await agent.aget_state(config)
+    if any(msg.type == "human" for msg in state.values.get("messages", [])):
+        return False, None
+
+    with track_stage("answer_cache"):
+        answer = await answer_cache.lookup(question)
+    if answer is not None:
+        # Сохраняем вопрос и ответ в историю, чтобы следующие вопросы видели контекст
+        await agent.aupdate_state(
+            config,
+            {"messages": [HumanMessage(content=question), AIMessage(content=answer)]},
+            as_node="model",
+        )
+    return True, answer
+
+
+def _agent_turn(
+    agent: CompiledStateGraph,
+    user_id: str,
+    answer_cache: AnswerCache | None,
+    chat_log_writer: ChatLogWriter,
+) -> TurnRunner:
+    """Ход агента: кэш ответов, стрим агента и запись диалога в лог"""
+    config = {"configurable": {"thread_id": str(user_id)}}
+
+    async def run(messages: list[TurnMessage]) -> AsyncIterator[TurnEvent]:
+        # Объединенные сообщения (политика merge) уходят агенту одним сообщением
+        content = "\n\n".join(message.content for message in messages)
+        user_query = "\n\n".join(m.query for m in messages if m.query) or None
+        if all(m.request_type == UserRequestType.text for m in messages):
+            request_type = UserRequestType.text
+        else:
+            request_type = UserRequestType.text_image
+
+        cacheable, cached_answer = await _lookup_cached_answer(
+            answer_cache, agent, config, user_query, request_type
+        )
+        # Версия уроков, по которой считается ответ этого хода
+        cache_version = answer_cache.version if cacheable else None
+        if cached_answer is not None:
+            response_text = cached_answer
+            yield "done", {"response": cached_answer}
+        else:
+            logger.info(f"Sending messages to the agent: {content}")
+            agent_messages = {"messages": {"role": "user", "content": content}}
+            async for event, data in stream_agent_events(agent, agent_messages, config):
+                yield event, data
+                if event == "done":
+                    response_text = data["response"]
+
+            if cacheable:
+                await answer_cache.store(user_query, response_text, cache_version)
+
+        # Update chat logs
+        try:
+            await chat_log_writer.log(user_id, user_query, response_text, request_type)
+        except Exception as e:
+            logger.error(f"Error logging interaction: {e}")
+
+    return run
+
+
+async def _turn_answer(events: AsyncIterator[TurnEvent]) -> str | None:
+    """
+    Ждет финальный ответ хода для эндпоинтов без стриминга. None, если сообщение
+    объединено с более поздним (политика merge) - ответ получит его запрос
+    """
+    async for event, data in events:
+        if event == "done":
+            return data["response"]
+        if event == "merged":
+            return None
+        if event == "error":
+            raise RuntimeError(data["detail"])
+    raise RuntimeError("Agent turn ended without an answer")
+
+
+def _turn_stream(events: AsyncIterator[TurnEvent]) -> StreamingResponse:
+    """
+    Оборачивает события хода в SSE ответ. Если сообщение объединено с более
+    поздним (политика merge), стрим заканчивается событием merged - ответ
+    придет в стрим последнего сообщения
+    """
+
+    async def event_stream():
+        async for event, data in events:
+            yield format_sse(event, data)
+            if event in ("done", "merged", "error"):
+                return
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _image_message(
+    text: str, image: UploadFile, vision_model: BaseChatModel
+) -> str:
+    """Текст сообщения с описанием картинки вместо base64"""
+    with track_stage("upload_read"):
+        content = await image.read()
+    description = await describe_image(content, text, vision_model)
+    return f"{text}\n\n{IMAGE_BLOCK}: {description}"
+
+
+async def _build_text_message(
+    question: str | None,
+    image: UploadFile | None,
+    vision_model: BaseChatModel,
+    message_id: str | None = None,
+) -> TurnMessage:
+    """Собирает сообщение для агента из текста и/или изображения"""
+    if question and image:
+        logger.info(f"Processing question '{question}' and image {image.filename}")
+        content = await _image_message(question, image, vision_model)
+        request_type = UserRequestType.text_image
+
+    elif image:
+        logger.info(f"Processing image {image.filename} without question")
+        content = await _image_message(IMAGE_ONLY_PROMPT, image, vision_model)
+        request_type = UserRequestType.text_image
+
+    elif question:
+        logger.info(f"Processing question '{question}' without images")
+        content = question
+        request_type = UserRequestType.text
+
+    else:
+        raise ValueError("Question or image is required")
+
+    return TurnMessage(
+        content=content,
+        query=question,
+        request_type=request_type,
+        message_id=message_id,
+    )
+
+
+async def _build_audio_message(
+    audio: UploadFile | None,
+    image: UploadFile | None,
+    transcription_service: TranscriptionService,
+    vision_model: BaseChatModel,
+    audio_id: str | None = None,
+    message_id: str | None = None,
+) -> TurnMessage:
+    """Собирает сообщение для агента из голосового и/или изображения"""
+    transcript = "изображение"
+
+    if audio and image:
+        logger.info(f"Processing audio '{audio.filename}' and image {image.filename}")
+        transcript = await transcription_service.transcribe(audio, audio_id)
+        content = await _image_message(transcript, image, vision_model)
+        request_type = UserRequestType.text_image
+
+    elif image:
+        logger.info(f"Processing image {image.filename} without question")
+        content = await _image_message(IMAGE_ONLY_PROMPT, image, vision_model)
+        request_type = UserRequestType.text_image
+
+    else:
+        transcript = await transcription_service.transcribe(audio, audio_id)
+        logger.info(f"Processing question '{transcript}' without images")
+        content = transcript
+        request_type = UserRequestType.text
+
+    return TurnMessage(
+        content=content,
+        query=transcript,
+        request_type=request_type,
+        message_id=message_id,
+    )
+
+
 @router.post("/text", response_model=ChatResponse)
 async def invoke_text_agent(
-    background_tasks: BackgroundTasks,
     user_id: str = Form(...),
     question: str | None = Form(default=None),
     image: UploadFile | None = File(default=None),
+    message_id: str | None = Form(default=None),
     agent=Depends(get_agent),
-    db: AsyncSession = Depends(get_db),
+    vision_model: BaseChatModel = Depends(get_vision_model),
+    answer_cache: AnswerCache | None = Depends(get_answer_cache),
+    chat_log_writer: ChatLogWriter = Depends(get_chat_log_writer),
+    turn_controller: ChatTurnController = Depends(get_turn_controller),
 ):
     try:
-        if question and image:
-            # IMPORTANT: Чтобы сократить количество токенов, желательно не сохранять base64 в истории.
-            # IMPORTANT: Вместо этого добавить агента, описывающего фото, и сохранять только его ответ
-            logger.info(f"Processing question '{question}' and image {image.filename}")
-            content = await image.read()
-            image_base64 = encode_image(content)
-            messages = {
-                "messages": {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": question,
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            },
-                        },
-                    ],
-                }
-            }
-            request_type = UserRequestType.text_image
-
-        elif image:
-            # IMPORTANT: Чтобы сократить количество токенов, желательно не сохранять base64 в истории.
-            # IMPORTANT: Вместо этого добавить агента, описывающего фото, и сохранять только его ответ
-            logger.info(f"Processing image {image.filename} without question")
-            content = await image.read()
-            image_base64 = encode_image(content)
-            messages = {
-                "messages": {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Ответь на запрос пользователя, в зависимости от картинки",
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            },
-                        },
-                    ],
-                }
-            }
-            request_type = UserRequestType.text_image
+        message = await _build_text_message(
+            question, image, vision_model, message_id
+        )
+        response_text = await _turn_answer(
+            turn_controller.submit(
+                user_id,
+                message,
+                _agent_turn(agent, user_id, answer_cache, chat_log_writer),
+            )
+        )
+        if response_text is None:
+            return ChatResponse(user_id=user_id, response="", merged=True)
+        return ChatResponse(user_id=user_id, response=response_text)
 
-        else:
-            logger.info(f"Processing question '{question}' without images")
-            messages = {"messages": {"role": "user", "content": question}}
-            request_type = UserRequestType.text
+    except Exception as e:
+        logger.error(f"Error processing request: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if not messages:
-            logger.error("No messages returned from agent")
-            raise ValueError("No messages returned from agent")
 
-        logger.info(f"Sending messages to the agent: {messages}")
-        model_response = agent.invoke(
-            messages, {"configurable": {"thread_id": str(user_id)}}
+@router.post("/text/stream")
+async def stream_text_agent(
+    user_id: str = Form(...),
+    question: str | None = Form(default=None),
+    image: UploadFile | None = File(default=None),
+    message_id: str | None = Form(default=None),
+    agent=Depends(get_agent),
+    vision_model: BaseChatModel = Depends(get_vision_model),
+    answer_cache: AnswerCache | None = Depends(get_answer_cache),
+    chat_log_writer: ChatLogWriter = Depends(get_chat_log_writer),
+    turn_controller: ChatTurnController = Depends(get_turn_controller),
+):
+    try:
+        message = await _build_text_message(
+            question, image, vision_model, message_id
         )
-
-        response_text = model_response["messages"][-1].content
-
-        # Update chat logs
-        background_tasks.add_task(
-            log_interaction,
-            db,
-            user_id,
-            question,
-            response_text,
-            request_type,
+        return _turn_stream(
+            turn_controller.submit(
+                user_id,
+                message,
+                _agent_turn(agent, user_id, answer_cache, chat_log_writer),
+            )
         )
 
-        return ChatResponse(user_id=user_id, response=response_text)
-
     except Exception as e:
         logger.error(f"Error processing request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -130,100 +339,64 @@ async def invoke_text_agent(
 
 @router.post("/audio", response_model=ChatResponse)
 async def invoke_audio_agent(
-    background_tasks: BackgroundTasks,
     user_id: str = Form(...),
     audio: UploadFile | None = File(default=None),
+    audio_id: str | None = Form(default=None),
     image: UploadFile | None = File(default=None),
+    message_id: str | None = Form(default=None),
     agent=Depends(get_agent),
-    db: AsyncSession = Depends(get_db),
+    transcription_service: TranscriptionService = Depends(get_transcription_service),
+    vision_model: BaseChatModel = Depends(get_vision_model),
+    answer_cache: AnswerCache | None = Depends(get_answer_cache),
+    chat_log_writer: ChatLogWriter = Depends(get_chat_log_writer),
+    turn_controller: ChatTurnController = Depends(get_turn_controller),
 ):
-    transcript = "изображение"
     try:
-        if audio and image:
-            # IMPORTANT: Чтобы сократить количество токенов, желательно не сохранять base64 в истории.
-            # IMPORTANT: Вместо этого добавить агента, описывающего фото, и сохранять только его ответ
-            logger.info(
-                f"Processing audio '{audio.filename}' and image {image.filename}"
+        message = await _build_audio_message(
+            audio, image, transcription_service, vision_model, audio_id, message_id
+        )
+        response_text = await _turn_answer(
+            turn_controller.submit(
+                user_id,
+                message,
+                _agent_turn(agent, user_id, answer_cache, chat_log_writer),
             )
+        )
+        if response_text is None:
+            return ChatResponse(user_id=user_id, response="", merged=True)
+        return ChatResponse(user_id=user_id, response=response_text)
 
-            content = await image.read()
-            image_base64 = encode_image(content)
-
-            transcript = await transcribe_audio(audio)
-
-            messages = {
-                "messages": {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": transcript,
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            },
-                        },
-                    ],
-                }
-            }
-            request_type = UserRequestType.text_image
-
-        elif image:
-            # IMPORTANT: Чтобы сократить количество токенов, желательно не сохранять base64 в истории.
-            # IMPORTANT: Вместо этого добавить агента, описывающего фото, и сохранять только его ответ
-            logger.info(f"Processing image {image.filename} without question")
-            content = await image.read()
-            image_base64 = encode_image(content)
-            messages = {
-                "messages": {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Ответь на запрос пользователя, в зависимости от картинки",
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"  # TODO: add other extensions
-                            },
-                        },
-                    ],
-                }
-            }
-            request_type = UserRequestType.text_image
-
-        else:
-            transcript = await transcribe_audio(audio)
-            logger.info(f"Processing question '{transcript}' without images")
-            messages = {"messages": {"role": "user", "content": transcript}}
-            request_type = UserRequestType.text
+    except Exception as e:
+        logger.error(f"Error processing request: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if not messages:
-            logger.error("No messages returned from agent")
-            raise ValueError("No messages returned from agent")
 
-        logger.info(f"Sending messages to the agent: {messages}")
-        model_response = agent.invoke(
-            messages, {"configurable": {"thread_id": str(user_id)}}
+@router.post("/audio/stream")
+async def stream_audio_agent(
+    user_id: str = Form(...),
+    audio: UploadFile | None = File(default=None),
+    audio_id: str | None = Form(default=None),
+    image: UploadFile | None = File(default=None),
+    message_id: str | None = Form(default=None),
+    agent=Depends(get_agent),
+    transcription_service: TranscriptionService = Depends(get_transcription_service),
+    vision_model: BaseChatModel = Depends(get_vision_model),
+    answer_cache: AnswerCache | None = Depends(get_answer_cache),
+    chat_log_writer: ChatLogWriter = Depends(get_chat_log_writer),
+    turn_controller: ChatTurnController = Depends(get_turn_controller),
+):
+    try:
+        message = await _build_audio_message(
+            audio, image, transcription_service, vision_model, audio_id, message_id
         )
-
-        response_text = model_response["messages"][-1].content
-
-        # Update chat logs
-        background_tasks.add_task(
-            log_interaction,
-            db,
-            user_id,
-            transcript,
-            response_text,
-            request_type,
+        return _turn_stream(
+            turn_controller.submit(
+                user_id,
+                message,
+                _agent_turn(agent, user_id, answer_cache, chat_log_writer),
+            )
         )
 
-        return ChatResponse(user_id=user_id, response=response_text)
-
     except Exception as e:
         logger.error(f"Error processing request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -231,10 +404,15 @@ async def invoke_audio_agent(
 
 @router.post("/delete_history")
 async def delete_history(
-    user_id: str = Form(...), agent: CompiledStateGraph = Depends(get_agent)
+    user_id: str = Form(...),
+    agent: CompiledStateGraph = Depends(get_agent),
+    turn_controller: ChatTurnController = Depends(get_turn_controller),
 ):
     try:
-        delete_all_messages(user_id, agent)
+        # В очереди треда: незавершенный ход не допишет чекпоинт после удаления
+        await turn_controller.run_exclusive(
+            user_id, lambda: delete_all_messages(user_id, agent)
+        )
         return {"detail": "Successfully cleared chat history"}
 
     except Exception as e:
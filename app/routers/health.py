@@ -1,5 +1,8 @@
 import logging
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+from app.services.readiness import check_readiness
 
 logger = logging.getLogger(__name__)
 
@@ -10,3 +13,46 @@ router = APIRouter()
 async def health_check():
     logger.info("Health Check")
     return {"status": "ok"}
+
+
+@router.get("/ready")
+async def readiness_check(request: Request):
+    """
+    Готовность принимать трафик: прогрев в lifespan завершен и Postgres,
+    пул чекпоинтера и Qdrant отвечают. Иначе 503
+    """
+    state = request.app.state
+    if not getattr(state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+
+    checks = await check_readiness(state.checkpointer_pool, state.qdrant_client)
+    ready = all(check["ok"] for check in checks.values())
+    content = {
+        "status": "ready" if ready else "not_ready",
+        "checks": checks,
+        "warmup": getattr(state, "warmup", None),
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+
+@router.get("/health/checkpointer")
+async def checkpointer_pool_stats(request: Request):
+    """Статистика пула соединений чекпоинтера"""
+    pool = getattr(request.app.state, "checkpointer_pool", None)
+    if pool is None:
+        raise HTTPException(status_code=503, detail="Checkpointer pool not initialized")
+    stats = {"name": pool.name, **pool.get_stats()}
+    checkpointer = getattr(request.app.state, "checkpointer", None)
+    if checkpointer is not None:
+        stats["serializer"] = checkpointer.serde.stats()
+    retention = getattr(request.app.state, "checkpoint_retention", None)
+    if retention is not None:
+        stats["retention"] = retention.stats()
+    return stats
+
+
+@router.get("/health/cache")
+async def cache_stats(request: Request):
+    """Счетчики попаданий в кэши"""
+    caches = getattr(request.app.state, "caches", {})
+    return {name: cache.stats() for name, cache in caches.items()}
@@ -0,0 +1,15 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from app.services.metrics import render_metrics
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    """Метрики в формате Prometheus: этапы запросов, токены LLM, кэши"""
+    caches = getattr(request.app.state, "caches", {})
+    return PlainTextResponse(render_metrics(caches), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,23 +1,90 @@
-import io
+import httpx
 import openai
 
 from fastapi import UploadFile
 
 from app.core.config import settings
+from app.services.metrics import track_stage
+from app.services.transcript_cache import TranscriptCache, transcript_cache_key
 
 
-async def transcribe_audio(audio_file: UploadFile) -> str:
+class TranscriptionService:
     """
     Транскрибация аудио через OpenAI Whisper API.
+
+    Один клиент на всё приложение: соединения к OpenAI переиспользуются
+    между запросами, а не открываются заново на каждое голосовое.
+    Повторные и пересланные голосовые берутся из кэша без вызова Whisper.
     """
-    buffer = io.BytesIO(await audio_file.read())
-    buffer.name = "audio.mp3"
 
-    # клиент openai напрямую для whisper
-    client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    def __init__(self, client: openai.AsyncOpenAI, cache: TranscriptCache):
+        self.client = client
+        self.cache = cache
 
-    transcript = await client.audio.transcriptions.create(
-        model="whisper-1", file=buffer
-    )
+    async def transcribe(
+        self, audio_file: UploadFile, audio_id: str | None = None
+    ) -> str:
+        # С audio_id кэш проверяется до чтения файла, при попадании он не читается
+        cache_key = transcript_cache_key(audio_id=audio_id) if audio_id else None
+        if cache_key is not None:
+            cached = await self.cache.aget(cache_key)
+            if cached is not None:
+                return cached
+
+        # Размер из заголовков проверяем до чтения, чтобы не буферизовать большой файл
+        if (
+            audio_file.size is not None
+            and audio_file.size > settings.AUDIO_MAX_SIZE_BYTES
+        ):
+            raise ValueError(
+                f"Audio file is too large: {audio_file.size} bytes "
+                f"(max {settings.AUDIO_MAX_SIZE_BYTES})"
+            )
+
+        with track_stage("upload_read"):
+            content = await audio_file.read(settings.AUDIO_MAX_SIZE_BYTES + 1)
+        if len(content) > settings.AUDIO_MAX_SIZE_BYTES:
+            raise ValueError(
+                f"Audio file is too large (max {settings.AUDIO_MAX_SIZE_BYTES} bytes)"
+            )
+
+        if cache_key is None:
+            cache_key = transcript_cache_key(content)
+            cached = await self.cache.aget(cache_key)
+            if cached is not None:
+                return cached
+
+        # Whisper определяет контейнер по имени файла, поэтому передаем настоящее
+        filename = audio_file.filename or "audio.ogg"
+        content_type = audio_file.content_type or "application/octet-stream"
 
-    return transcript.text
+        with track_stage("transcription"):
+            transcript = await self.client.audio.transcriptions.create(
+                model=settings.TRANSCRIPTION_MODEL,
+                file=(filename, content, content_type),
+            )
+
+        await self.cache.aset(cache_key, transcript.text)
+        return transcript.text
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+def create_transcription_service() -> TranscriptionService:
+    client = openai.AsyncOpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        timeout=settings.TRANSCRIPTION_TIMEOUT,
+        max_retries=settings.TRANSCRIPTION_MAX_RETRIES,
+        http_client=openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=settings.TRANSCRIPTION_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.TRANSCRIPTION_MAX_CONNECTIONS,
+            ),
+        ),
+    )
+    cache = TranscriptCache(
+        max_size=settings.TRANSCRIPT_CACHE_SIZE,
+        persistent=settings.TRANSCRIPT_CACHE_PERSISTENT,
+    )
+    return TranscriptionService(client, cache)
@@ -1,6 +1,103 @@
+import asyncio
 import base64
+import io
+from dataclasses import dataclass
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+
+from app.core.config import settings
+from app.core.prompts import IMAGE_DESCRIPTION_PROMPT
+from app.services.metrics import LLMMetricsCallback, track_stage
+
+
+def create_vision_model() -> ChatOpenAI:
+    return ChatOpenAI(
+        model="gpt-4o-mini", temperature=0, callbacks=[LLMMetricsCallback("vision")]
+    )
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    detail: str
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{encode_image(self.data)}"
 
 
 def encode_image(image_bytes: bytes) -> str:
     """Кодирует картинку в base64"""
     return base64.b64encode(image_bytes).decode("utf-8")
+
+
+def prepare_image(image_bytes: bytes) -> PreparedImage:
+    """
+    Определяет реальный формат картинки, уменьшает её до IMAGE_MAX_SIDE
+    и перекодирует в JPEG. Маленькие картинки отправляются с detail=low.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image_format = image.format
+        orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+        image = ImageOps.exif_transpose(image)
+    except UnidentifiedImageError:
+        raise ValueError("Unsupported image format")
+
+    detail = "low" if max(image.size) <= settings.IMAGE_LOW_DETAIL_MAX_SIDE else "high"
+
+    # Уже подходящий JPEG отправляем без перекодирования. Фото с EXIF поворотом
+    # перекодируем: исходные байты дошли бы до модели повернутыми
+    if (
+        image_format == "JPEG"
+        and orientation == 1
+        and max(image.size) <= settings.IMAGE_MAX_SIDE
+    ):
+        return PreparedImage(image_bytes, "image/jpeg", detail)
+
+    image.thumbnail((settings.IMAGE_MAX_SIDE, settings.IMAGE_MAX_SIDE))
+    if image.mode != "RGB":
+        # Прозрачный фон заливаем белым, JPEG не поддерживает альфа-канал
+        background = Image.new("RGB", image.size, "white")
+        image = image.convert("RGBA")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+
+    buffer = io.BytesIO()
+    image.save(
+        buffer, format="JPEG", quality=settings.IMAGE_JPEG_QUALITY, optimize=True
+    )
+    return PreparedImage(buffer.getvalue(), "image/jpeg", detail)
+
+
+async def describe_image(
+    image_bytes: bytes, question: str, vision_model: BaseChatModel
+) -> str:
+    """
+    Одноразовое описание картинки vision моделью.
+
+    В историю диалога (и в чекпоинт) попадает только это описание, а не base64,
+    поэтому картинка не пересылается модели на каждом следующем ходе.
+    """
+    # Pillow работает синхронно, поэтому выносим обработку из event loop
+    with track_stage("image_prepare"):
+        image = await asyncio.to_thread(prepare_image, image_bytes)
+
+    message = HumanMessage(
+        content=[
+            {
+                "type": "text",
+                "text": IMAGE_DESCRIPTION_PROMPT.format(question=question),
+            },
+            {
+                "type": "image_url",
+                "image_url": {"url": image.data_url, "detail": image.detail},
+            },
+        ]
+    )
+    response = await vision_model.ainvoke([message])
+    return response.content
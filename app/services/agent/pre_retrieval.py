@@ -0,0 +1,97 @@
+import asyncio
+import logging
+from typing import Callable
+
+from langchain.agents.middleware import ModelRequest, ModelResponse, wrap_model_call
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import HumanMessage
+from langchain_core.tools import BaseTool
+from langgraph.constants import TAG_NOSTREAM
+
+from app.core.prompts import HYDE_PROMPT, IMAGE_BLOCK, PRE_RETRIEVAL_CONTEXT_TEMPLATE
+from app.services.agent.tools.retrieve import (
+    deduplicate_chunks,
+    format_context,
+    limit_context,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def _retrieve(retrieve_docs: BaseTool, query: str) -> list[Document]:
+    """Вызывает retrieve_docs напрямую и возвращает найденные документы (artifact)"""
+    message = await retrieve_docs.ainvoke(
+        {
+            "type": "tool_call",
+            "id": "pre_retrieval",
+            "name": retrieve_docs.name,
+            "args": {"query": query},
+        }
+    )
+    return message.artifact or []
+
+
+async def _hyde_retrieve(
+    retrieve_docs: BaseTool, hyde_model: BaseChatModel, question: str
+) -> list[Document]:
+    hypothetical = await hyde_model.ainvoke(HYDE_PROMPT.format(question=question))
+    return await _retrieve(retrieve_docs, hypothetical.text)
+
+
+def create_pre_retrieval_middleware(
+    retrieve_docs: BaseTool,
+    hyde_model: BaseChatModel | None = None,
+    max_context_chars: int | None = None,
+):
+    """
+    Middleware режима pre_retrieval: поиск по урокам выполняется до вызова модели,
+    найденный контекст приклеивается к последнему вопросу пользователя только
+    для этого вызова (в историю чата не сохраняется). Ответ получается за один
+    вызов модели вместо HyDE + tool call + ответ.
+
+    С hyde_model поиск по исходному вопросу идет параллельно с генерацией
+    гипотетического ответа и поиском по нему, результаты объединяются.
+    """
+    if hyde_model is not None:
+        # Токены HyDE не должны попадать в стрим ответа пользователю
+        hyde_model = hyde_model.with_config(tags=[TAG_NOSTREAM])
+
+    @wrap_model_call
+    async def pre_retrieval(
+        request: ModelRequest,
+        handler: Callable[[ModelRequest], ModelResponse],
+    ) -> ModelResponse:
+        if not request.messages or not isinstance(request.messages[-1], HumanMessage):
+            return await handler(request)
+
+        last_message = request.messages[-1]
+        question = last_message.text
+        if not question or IMAGE_BLOCK in question:
+            return await handler(request)
+
+        try:
+            if hyde_model is None:
+                docs = await _retrieve(retrieve_docs, question)
+            else:
+                raw_docs, hyde_docs = await asyncio.gather(
+                    _retrieve(retrieve_docs, question),
+                    _hyde_retrieve(retrieve_docs, hyde_model, question),
+                )
+                docs = limit_context(
+                    deduplicate_chunks(raw_docs + hyde_docs), max_context_chars
+                )
+        except Exception as e:
+            logger.error(f"Error in pre-retrieval: {e}")
+            return await handler(request)
+
+        content = PRE_RETRIEVAL_CONTEXT_TEMPLATE.format(
+            question=question, context=format_context(docs)
+        )
+        messages = [
+            *request.messages[:-1],
+            last_message.model_copy(update={"content": content}),
+        ]
+        return await handler(request.override(messages=messages))
+
+    return pre_retrieval
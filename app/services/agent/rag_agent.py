@@ -1,24 +1,56 @@
+from langchain_core.language_models import BaseChatModel
+from langchain_core.tools import BaseTool
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_qdrant import QdrantVectorStore, FastEmbedSparse, RetrievalMode
 from langchain.agents import create_agent
 from langgraph.graph.state import CompiledStateGraph
-from langgraph.checkpoint.postgres import PostgresSaver
-from qdrant_client import QdrantClient
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from qdrant_client import QdrantClient, AsyncQdrantClient, models
 
 from app.core.config import settings
-from app.core.prompts import SYSTEM_PROMPT
+from app.core.prompts import PRE_RETRIEVAL_SYSTEM_PROMPT, SYSTEM_PROMPT
+from app.core.qdrant_profiles import get_qdrant_profile
 from app.models.schemas import CustomAgentState
+from app.services.embedding_cache import (
+    CachedEmbeddings,
+    CachedSparseEmbeddings,
+    with_query_cache,
+)
+from app.services.metrics import LLMMetricsCallback
+from app.services.agent.pre_retrieval import create_pre_retrieval_middleware
+from app.services.agent.rerank import Reranker
 from app.services.agent.tools.retrieve import create_retrieve_docs_tool
-from app.services.agent.tools.messages import trim_messages
+from app.services.agent.tools.messages import create_trim_messages
 
 
-# client = QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-sparse_embeddings = FastEmbedSparse(model_name="Qdrant/bm25")
-model = ChatOpenAI(model="gpt-4o-mini", temperature=0.7)
+def create_embeddings() -> tuple[CachedEmbeddings, CachedSparseEmbeddings]:
+    """
+    Dense и sparse эмбеддинги с кэшем запросов. Создаются в lifespan, а не при
+    импорте: FastEmbedSparse загружает (и при первом запуске скачивает) модель BM25.
+    Блокирующая, вызывать через asyncio.to_thread
+    """
+    return with_query_cache(
+        OpenAIEmbeddings(model=settings.EMBEDDING_MODEL),
+        FastEmbedSparse(model_name=settings.SPARSE_MODEL),
+        dense_namespace=settings.EMBEDDING_MODEL,
+        sparse_namespace=settings.SPARSE_MODEL,
+        max_size=settings.EMBEDDING_CACHE_SIZE,
+        ttl=settings.EMBEDDING_CACHE_TTL,
+        persistent=settings.EMBEDDING_CACHE_PERSISTENT,
+    )
+
+
+def create_chat_model() -> ChatOpenAI:
+    return ChatOpenAI(
+        model="gpt-4o-mini", temperature=0.7, callbacks=[LLMMetricsCallback("llm")]
+    )
 
 
-def get_vector_store(client: QdrantClient) -> QdrantVectorStore:
+def get_vector_store(
+    client: QdrantClient,
+    embeddings: CachedEmbeddings,
+    sparse_embeddings: CachedSparseEmbeddings,
+) -> QdrantVectorStore:
     return QdrantVectorStore(
         client=client,
         collection_name=settings.QDRANT_COLLECTION_NAME,
@@ -30,13 +62,82 @@ def get_vector_store(client: QdrantClient) -> QdrantVectorStore:
     )
 
 
-def build_rag_agent(checkpointer: PostgresSaver):
-    qdrant_client = QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
-    vector_store = get_vector_store(qdrant_client)
-    retrieve_docs = create_retrieve_docs_tool(vector_store)
+def build_retrieve_docs_tool(
+    vector_store: QdrantVectorStore,
+    async_qdrant_client: AsyncQdrantClient,
+    reranker: Reranker | None = None,
+) -> BaseTool:
+    # Параметры поиска должны соответствовать профилю, с которым создана коллекция
+    profile = get_qdrant_profile(settings.QDRANT_PROFILE)
+    return create_retrieve_docs_tool(
+        vector_store,
+        async_qdrant_client,
+        search_params=profile.search_params(),
+        # После переранжирования достаточно меньшего числа сильных чанков
+        k=settings.RERANK_TOP_N if reranker else settings.RETRIEVAL_K,
+        fetch_k=settings.RETRIEVAL_FETCH_K,
+        score_threshold=settings.RETRIEVAL_SCORE_THRESHOLD,
+        fusion=models.Fusion(settings.RETRIEVAL_FUSION),
+        max_context_chars=settings.RETRIEVAL_MAX_CONTEXT_CHARS,
+        reranker=reranker,
+        rerank_candidates=settings.RERANK_CANDIDATES,
+    )
+
+
+def build_rag_agent(
+    checkpointer: AsyncPostgresSaver,
+    async_qdrant_client: AsyncQdrantClient,
+    vector_store: QdrantVectorStore,
+    chat_model: BaseChatModel,
+    reranker: Reranker | None = None,
+    helper_model: BaseChatModel | None = None,
+):
+    """
+    helper_model (HyDE и краткое содержание истории) по умолчанию создается
+    из настроек, в бенчмарке подменяется фейком
+    """
+    retrieve_docs = build_retrieve_docs_tool(
+        vector_store, async_qdrant_client, reranker=reranker
+    )
+
+    summary_model = None
+    if settings.HISTORY_SUMMARY_ENABLED:
+        summary_model = helper_model or ChatOpenAI(
+            model=settings.HISTORY_SUMMARY_MODEL,
+            temperature=0,
+            max_tokens=settings.HISTORY_SUMMARY_MAX_TOKENS,
+            callbacks=[LLMMetricsCallback("history_summary")],
+        )
+    trim_messages = create_trim_messages(
+        settings.HISTORY_MAX_TOKENS, summary_model=summary_model
+    )
+
+    if settings.AGENT_MODE == "pre_retrieval":
+        hyde_model = None
+        if settings.PRE_RETRIEVAL_HYDE:
+            hyde_model = helper_model or ChatOpenAI(
+                model=settings.HYDE_MODEL,
+                temperature=0,
+                max_tokens=settings.HYDE_MAX_TOKENS,
+                callbacks=[LLMMetricsCallback("hyde")],
+            )
+        pre_retrieval = create_pre_retrieval_middleware(
+            retrieve_docs,
+            hyde_model=hyde_model,
+            max_context_chars=settings.RETRIEVAL_MAX_CONTEXT_CHARS,
+        )
+        # Без инструментов модель отвечает за один вызов
+        return create_agent(
+            model=chat_model,
+            tools=[],
+            state_schema=CustomAgentState,
+            system_prompt=PRE_RETRIEVAL_SYSTEM_PROMPT,
+            checkpointer=checkpointer,
+            middleware=[trim_messages, pre_retrieval],
+        )
 
     rag_agent: CompiledStateGraph = create_agent(
-        model=model,
+        model=chat_model,
         tools=[retrieve_docs],
         state_schema=CustomAgentState,
         system_prompt=SYSTEM_PROMPT,
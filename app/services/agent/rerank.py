@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastembed.rerank.cross_encoder import TextCrossEncoder
+from langchain_core.documents import Document
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Reranker:
+    """
+    Второй этап поиска: кросс-энкодер (ONNX через fastembed) пересортировывает
+    кандидатов гибридного поиска.
+
+    Модель считает на CPU в отдельном пуле потоков, чтобы не блокировать event loop.
+    Если оценка не уложилась в timeout, возвращается исходный порядок после слияния.
+    Поток проверяет тот же дедлайн перед задачей и между пачками модели, поэтому
+    брошенные по таймауту задачи не занимают пул и не задерживают следующие запросы.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: int,
+        timeout: float,
+        threads: int | None = None,
+        max_workers: int = 1,
+    ):
+        self.model = TextCrossEncoder(model_name=model_name, threads=threads)
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="rerank"
+        )
+
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.skipped = 0  # задачи, брошенные потоком после дедлайна
+        self.warmup_seconds: float | None = None  # замер оценки при прогреве
+
+    def _score(
+        self, query: str, texts: list[str], deadline: float | None = None
+    ) -> list[float] | None:
+        """Оценки кандидатов или None, если дедлайн прошел до конца оценки"""
+        if deadline is not None and time.monotonic() > deadline:
+            self.skipped += 1
+            return None
+
+        scores = []
+        # rerank считает пачками по batch_size лениво, между пачками проверяем дедлайн
+        for score in self.model.rerank(query, texts, batch_size=self.batch_size):
+            scores.append(score)
+            if (
+                deadline is not None
+                and len(scores) < len(texts)
+                and time.monotonic() > deadline
+            ):
+                self.skipped += 1
+                return None
+        return scores
+
+    async def rerank(
+        self, query: str, docs: list[Document], top_n: int
+    ) -> list[Document]:
+        if len(docs) <= 1:
+            return docs[:top_n]
+
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        try:
+            scores = await asyncio.wait_for(
+                loop.run_in_executor(
+                    self._executor,
+                    self._score,
+                    query,
+                    [doc.page_content for doc in docs],
+                    time.monotonic() + self.timeout,
+                ),
+                timeout=self.timeout,
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(
+                f"Reranking took longer than {self.timeout}s, using fused order"
+            )
+            return docs[:top_n]
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error reranking documents: {e}")
+            return docs[:top_n]
+        if scores is None:
+            self.timeouts += 1
+            return docs[:top_n]
+
+        ranked = sorted(zip(scores, docs), key=lambda pair: pair[0], reverse=True)
+        return [doc for _, doc in ranked[:top_n]]
+
+    async def warmup(self, query: str, candidates: int = 1) -> None:
+        """
+        Первый вызов ONNX модели без таймаута, чтобы не платить за него в запросе,
+        затем замер оценки candidates кандидатов на этом железе
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._score, query, [query])
+
+        started_at = time.perf_counter()
+        await loop.run_in_executor(
+            self._executor, self._score, query, [query] * candidates
+        )
+        self.warmup_seconds = time.perf_counter() - started_at
+        if self.warmup_seconds > self.timeout:
+            logger.warning(
+                f"Reranking {candidates} candidates takes {self.warmup_seconds:.2f}s, "
+                f"above RERANK_TIMEOUT={self.timeout}s: requests will use fused order"
+            )
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "warmup_seconds": self.warmup_seconds,
+        }
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_reranker() -> Reranker | None:
+    if not settings.RERANK_ENABLED:
+        return None
+
+    return Reranker(
+        model_name=settings.RERANK_MODEL,
+        batch_size=settings.RERANK_BATCH_SIZE,
+        timeout=settings.RERANK_TIMEOUT,
+        threads=settings.RERANK_THREADS,
+    )
@@ -0,0 +1,60 @@
+import json
+import logging
+from typing import Any, AsyncIterator
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langgraph.graph.state import CompiledStateGraph
+
+logger = logging.getLogger(__name__)
+
+# Название узла модели в графе create_agent
+MODEL_NODE = "model"
+
+# Человекочитаемые статусы для вызовов инструментов
+TOOL_STATUSES = {
+    "retrieve_docs": "Ищу в уроках...",
+}
+
+
+def format_sse(event: str, data: dict[str, Any]) -> str:
+    """Форматирует одно server-sent event сообщение"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_agent_events(
+    agent: CompiledStateGraph, messages: dict, config: dict
+) -> AsyncIterator[tuple[str, dict[str, Any]]]:
+    """
+    Стримит ответ агента в виде событий (event, data):
+
+    - token: очередной кусок текста ответа модели
+    - tool: модель вызвала инструмент (например, поиск по урокам)
+    - done: финальный ответ целиком
+    """
+    response_text = ""
+
+    async for mode, payload in agent.astream(
+        messages, config, stream_mode=["messages", "updates"]
+    ):
+        if mode == "messages":
+            chunk, metadata = payload
+            if metadata.get("langgraph_node") != MODEL_NODE:
+                continue
+            if isinstance(chunk, AIMessageChunk) and chunk.text:
+                yield "token", {"text": chunk.text}
+
+        elif mode == "updates":
+            update = (payload or {}).get(MODEL_NODE) or {}
+            for message in update.get("messages", []):
+                if not isinstance(message, AIMessage):
+                    continue
+                if message.tool_calls:
+                    for tool_call in message.tool_calls:
+                        yield "tool", {
+                            "name": tool_call["name"],
+                            "status": TOOL_STATUSES.get(tool_call["name"], ""),
+                        }
+                else:
+                    response_text = message.content
+
+    yield "done", {"response": response_text}
@@ -1,52 +1,211 @@
+import json
 import logging
+import time
 
+import tiktoken
 from langchain.agents import AgentState
+from langgraph.constants import TAG_NOSTREAM
 from langgraph.graph.state import CompiledStateGraph
 from langchain.agents.middleware import before_model
+from langchain_core.language_models import BaseChatModel
 from langgraph.graph.message import REMOVE_ALL_MESSAGES
-from langchain_core.messages import RemoveMessage
+from langchain_core.messages import (
+    AnyMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
 from langgraph.runtime import Runtime
 from typing import Any
 from langchain_core.messages import AIMessage
 
-from app.core.prompts import SYSTEM_PROMPT
+from app.core.prompts import HISTORY_SUMMARY_PROMPT
 
 
-def delete_all_messages(user_id: str, agent: CompiledStateGraph):
-    config = {"configurable": {"thread_id": str(user_id)}}
-    state = agent.get_state(config)
+async def delete_all_messages(user_id: str, agent: CompiledStateGraph):
+    """
+    Удаляет тред целиком из таблиц чекпоинтера, вместо записи нового чекпоинта
+    с RemoveMessage для каждого сообщения
+    """
+    await agent.checkpointer.adelete_thread(str(user_id))
 
-    delete_instructions = [
-        RemoveMessage(id=msg.id) for msg in state.values.get("messages", [])
+
+# Сообщение с кратким содержанием старой части диалога, ID постоянный, чтобы его заменять
+SUMMARY_MESSAGE_ID = "history_summary"
+TOOL_OUTPUT_STUB = "[Контекст из уроков для прошлого вопроса опущен]"
+# Служебные токены на каждое сообщение в формате chat completions
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+# Через сколько секунд повторить загрузку словаря tiktoken после ошибки
+ENCODING_RETRY_INTERVAL = 60.0
+
+_encoding: tiktoken.Encoding | None = None
+_encoding_failed_at: float | None = None
+
+
+def _get_encoding() -> tiktoken.Encoding | None:
+    """
+    Кэшируется только успешно загруженный словарь: после ошибки (например, сети
+    при скачивании) токены оцениваются по длине текста до следующей попытки
+    """
+    global _encoding, _encoding_failed_at
+    if _encoding is not None:
+        return _encoding
+    if (
+        _encoding_failed_at is not None
+        and time.monotonic() - _encoding_failed_at < ENCODING_RETRY_INTERVAL
+    ):
+        return None
+
+    try:
+        # Словарь моделей семейства gpt-4o
+        _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Словарь tiktoken скачивается при первом использовании
+        logging.warning(f"tiktoken encoding unavailable, estimating tokens: {e}")
+        _encoding_failed_at = time.monotonic()
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 3 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message: AnyMessage) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + count_tokens(message.text)
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(tool_call["name"] + json.dumps(tool_call["args"]))
+    return tokens
+
+
+def _split_turns(messages: list[AnyMessage]) -> list[list[AnyMessage]]:
+    """Делит историю на ходы: сообщение пользователя и все ответы/вызовы инструментов после него"""
+    turns: list[list[AnyMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _stub_tool_outputs(turn: list[AnyMessage]) -> list[AnyMessage]:
+    return [
+        (
+            message.model_copy(update={"content": TOOL_OUTPUT_STUB, "artifact": None})
+            if isinstance(message, ToolMessage) and message.content != TOOL_OUTPUT_STUB
+            else message
+        )
+        for message in turn
     ]
-    restore_system_prompt = AIMessage(content=SYSTEM_PROMPT)
 
-    agent.update_state(
-        config,
-        {"messages": delete_instructions + [restore_system_prompt]},
+
+async def _summarize(
+    summary_model: BaseChatModel, summary: str, messages: list[AnyMessage]
+) -> str:
+    dialog = "\n".join(
+        f"{message.type}: {message.text}"
+        for message in messages
+        if isinstance(message, (HumanMessage, AIMessage)) and message.text
     )
+    if not dialog:
+        return summary
 
+    response = await summary_model.ainvoke(
+        HISTORY_SUMMARY_PROMPT.format(summary=summary or "-", dialog=dialog)
+    )
+    return response.text
 
-@before_model
-def trim_messages(
-    state: AgentState,
-    runtime: Runtime,
-    num_to_keep: int = 3,  # TODO: Change to 10
-) -> dict[str, Any] | None:
-    messages = state["messages"]
 
-    try:
-        if len(messages) <= num_to_keep:
+def create_trim_messages(max_tokens: int, summary_model: BaseChatModel | None = None):
+    """
+    before_model middleware, ограничивающее историю бюджетом токенов (tiktoken).
+
+    - текущий ход (последний вопрос и все после него) сохраняется целиком;
+    - в прошлых ходах ответы retrieve_docs заменяются короткой заглушкой;
+    - старые ходы отбрасываются целиком, пока история не уложится в max_tokens;
+    - с summary_model отброшенные ходы сворачиваются в краткое содержание,
+      которое хранится в state["summary"] и идет в начале истории.
+
+    Первое сообщение диалога сохраняется, как и раньше.
+    """
+    if summary_model is not None:
+        summary_model = summary_model.with_config(tags=[TAG_NOSTREAM])
+
+    @before_model
+    async def trim_messages(
+        state: AgentState, runtime: Runtime
+    ) -> dict[str, Any] | None:
+        messages = [
+            message for message in state["messages"] if message.id != SUMMARY_MESSAGE_ID
+        ]
+        summary = state.get("summary", "")
+
+        if len(messages) <= 1:
             return None
 
-        first_msg = messages[0]
-        while num_to_keep < len(messages) and messages[-num_to_keep].type == "tool":
-            num_to_keep += 1
+        try:
+            first_msg = messages[0]
+            turns = _split_turns(messages[1:])
+            current_turn = turns.pop() if turns else []
+            old_turns = [_stub_tool_outputs(turn) for turn in turns]
 
-        recent_messages = [first_msg] + messages[-num_to_keep - 1 :]
+            budget = (
+                max_tokens
+                - message_tokens(first_msg)
+                - sum(message_tokens(message) for message in current_turn)
+                - (count_tokens(summary) if summary else 0)
+            )
 
-        return {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *recent_messages]}
+            kept: list[list[AnyMessage]] = []
+            for turn in reversed(old_turns):
+                turn_tokens = sum(message_tokens(message) for message in turn)
+                if turn_tokens > budget:
+                    break
+                budget -= turn_tokens
+                kept.insert(0, turn)
+            dropped = old_turns[: len(old_turns) - len(kept)]
 
-    except Exception as e:
-        logging.error(f"Error truncating messages: {e}")
-        return {"messages": messages}
+            stubbed = any(
+                new is not old
+                for turn, old_turn in zip(old_turns, turns)
+                for new, old in zip(turn, old_turn)
+            )
+            if not dropped and not stubbed:
+                return None
+
+            update: dict[str, Any] = {}
+            if dropped and summary_model is not None:
+                summary = await _summarize(
+                    summary_model,
+                    summary,
+                    [message for turn in dropped for message in turn],
+                )
+                update["summary"] = summary
+
+            recent_messages = [first_msg]
+            if summary:
+                recent_messages.append(
+                    SystemMessage(
+                        content=f"Краткое содержание предыдущей части диалога: {summary}",
+                        id=SUMMARY_MESSAGE_ID,
+                    )
+                )
+            recent_messages += [message for turn in kept for message in turn]
+            recent_messages += current_turn
+
+            update["messages"] = [
+                RemoveMessage(id=REMOVE_ALL_MESSAGES),
+                *recent_messages,
+            ]
+            return update
+
+        except Exception as e:
+            logging.error(f"Error truncating messages: {e}")
+            return None
+
+    return trim_messages
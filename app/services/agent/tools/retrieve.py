@@ -1,24 +1,223 @@
+import asyncio
+
+from langchain_core.documents import Document
 from langchain_core.tools import tool
 from langchain_qdrant import QdrantVectorStore
+from qdrant_client import AsyncQdrantClient, models
+
+from app.services.agent.rerank import Reranker
+from app.services.metrics import track_stage
+
+# Shorter common prefix/suffix is treated as coincidence, not as chunk overlap
+MIN_OVERLAP_CHARS = 50
+NO_CONTEXT = "No relevant lesson context found"
+
+
+async def ahybrid_search(
+    vector_store: QdrantVectorStore,
+    async_client: AsyncQdrantClient,
+    query: str,
+    k: int = 4,
+    search_params: models.SearchParams | None = None,
+    fetch_k: int | None = None,
+    score_threshold: float | None = None,
+    fusion: models.Fusion = models.Fusion.RRF,
+) -> list[Document]:
+    """
+    Async counterpart of QdrantVectorStore.similarity_search in HYBRID mode
+
+    Dense embedding goes through the async OpenAI client, BM25 runs in a thread,
+    and the fused query is sent with the async Qdrant client, so the event loop is never blocked.
+
+    :param vector_store: Vector store holding the collection and embedding settings
+    :type vector_store: QdrantVectorStore
+    :param async_client: Async Qdrant client used for the query
+    :type async_client: AsyncQdrantClient
+    :param query: Search query
+    :type query: str
+    :param k: Number of documents to return
+    :type k: int
+    :param search_params: HNSW and quantization params for the dense prefetch
+    :type search_params: models.SearchParams | None
+    :param fetch_k: Candidates taken from each of the dense and sparse searches before fusion
+    :type fetch_k: int | None
+    :param score_threshold: Minimal cosine similarity for dense candidates
+    :type score_threshold: float | None
+    :param fusion: How dense and sparse results are fused (RRF or DBSF)
+    :type fusion: models.Fusion
+    """
+    fetch_k = max(fetch_k or k, k)
+    with track_stage("embedding"):
+        dense_vector, sparse_vector = await asyncio.gather(
+            vector_store.embeddings.aembed_query(query),
+            vector_store.sparse_embeddings.aembed_query(query),
+        )
+
+    with track_stage("qdrant_search"):
+        response = await async_client.query_points(
+            collection_name=vector_store.collection_name,
+            prefetch=[
+                models.Prefetch(
+                    using=vector_store.vector_name,
+                    query=dense_vector,
+                    params=search_params,
+                    score_threshold=score_threshold,
+                    limit=fetch_k,
+                ),
+                models.Prefetch(
+                    using=vector_store.sparse_vector_name,
+                    query=models.SparseVector(
+                        indices=sparse_vector.indices,
+                        values=sparse_vector.values,
+                    ),
+                    limit=fetch_k,
+                ),
+            ],
+            query=models.FusionQuery(fusion=fusion),
+            limit=k,
+            with_payload=True,
+            with_vectors=False,
+        )
+
+    return [
+        QdrantVectorStore._document_from_point(
+            point,
+            vector_store.collection_name,
+            vector_store.content_payload_key,
+            vector_store.metadata_payload_key,
+        )
+        for point in response.points
+    ]
+
 
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of left that is also a prefix of right"""
+    head = right[:MIN_OVERLAP_CHARS]
+    start = left.find(head)
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(head, start + 1)
+    return 0
 
-def create_retrieve_docs_tool(vector_store: QdrantVectorStore):
+
+def deduplicate_chunks(docs: list[Document]) -> list[Document]:
+    """
+    Drop chunks already covered by better ranked ones and cut the text shared
+    with neighbouring chunks (the splitter overlaps consecutive chunks)
+
+    :param docs: Documents in ranking order
+    :type docs: list[Document]
+    """
+    kept: list[Document] = []
+    for doc in docs:
+        text = doc.page_content
+        for other in kept:
+            if len(text) < MIN_OVERLAP_CHARS:
+                break
+            if text in other.page_content:
+                text = ""
+                break
+            if overlap := _overlap(other.page_content, text):
+                text = text[overlap:]
+            if overlap := _overlap(text, other.page_content):
+                text = text[:-overlap]
+
+        if len(text.strip()) >= MIN_OVERLAP_CHARS:
+            kept.append(Document(page_content=text.strip(), metadata=doc.metadata))
+    return kept
+
+
+def limit_context(docs: list[Document], max_chars: int | None) -> list[Document]:
+    """
+    Keep documents in ranking order until the context reaches max_chars,
+    the last one is truncated to fit
+
+    :param docs: Documents in ranking order
+    :type docs: list[Document]
+    :param max_chars: Context size limit, None for no limit
+    :type max_chars: int | None
+    """
+    if max_chars is None:
+        return docs
+
+    limited, remaining = [], max_chars
+    for doc in docs:
+        if remaining < MIN_OVERLAP_CHARS:
+            break
+        text = doc.page_content[:remaining]
+        limited.append(Document(page_content=text, metadata=doc.metadata))
+        remaining -= len(text)
+    return limited
+
+
+def format_context(docs: list[Document]) -> str:
+    """Serialize retrieved chunks for the model"""
+    serialized = "\n\n".join(f"Context: {doc.page_content}" for doc in docs)
+    return serialized or NO_CONTEXT
+
+
+def create_retrieve_docs_tool(
+    vector_store: QdrantVectorStore,
+    async_client: AsyncQdrantClient,
+    search_params: models.SearchParams | None = None,
+    k: int = 4,
+    fetch_k: int | None = None,
+    score_threshold: float | None = None,
+    fusion: models.Fusion = models.Fusion.RRF,
+    max_context_chars: int | None = None,
+    reranker: Reranker | None = None,
+    rerank_candidates: int = 12,
+):
     """
     Factory function that creates a tool with a bound vector store
 
     :param vector_store: Pass vector store item to the retriever tool
     :type vector_store: QdrantVectorStore
+    :param async_client: Async Qdrant client for the non-blocking search
+    :type async_client: AsyncQdrantClient
+    :param search_params: Search params matching the collection's Qdrant profile
+    :type search_params: models.SearchParams | None
+    :param k: Number of chunks to retrieve
+    :type k: int
+    :param fetch_k: Candidates per search branch before fusion
+    :type fetch_k: int | None
+    :param score_threshold: Minimal cosine similarity for dense candidates
+    :type score_threshold: float | None
+    :param fusion: Hybrid fusion method
+    :type fusion: models.Fusion
+    :param max_context_chars: Limit for the context returned to the model
+    :type max_context_chars: int | None
+    :param reranker: Optional cross-encoder, when set rerank_candidates chunks
+        are fetched and the k best after reranking are kept
+    :type reranker: Reranker | None
+    :param rerank_candidates: Number of fused candidates passed to the reranker
+    :type rerank_candidates: int
     """
 
     @tool(
         response_format="content_and_artifact",
         description="Retrieve lesson Context for the answer",
     )
-    def retrieve_docs(query: str):
-        retrieved_docs = vector_store.similarity_search(query)
-        serialized = "\n\n".join(
-            f"Context: {doc.page_content}" for doc in retrieved_docs
+    async def retrieve_docs(query: str):
+        retrieved_docs = await ahybrid_search(
+            vector_store,
+            async_client,
+            query,
+            k=max(rerank_candidates, k) if reranker else k,
+            search_params=search_params,
+            fetch_k=fetch_k,
+            score_threshold=score_threshold,
+            fusion=fusion,
+        )
+        if reranker:
+            with track_stage("rerank"):
+                retrieved_docs = await reranker.rerank(
+                    query, retrieved_docs, top_n=k
+                )
+        retrieved_docs = limit_context(
+            deduplicate_chunks(retrieved_docs), max_context_chars
         )
-        return serialized, retrieved_docs
+        return format_context(retrieved_docs), retrieved_docs
 
     return retrieve_docs
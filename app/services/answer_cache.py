@@ -0,0 +1,169 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from qdrant_client import AsyncQdrantClient
+
+from app.core.qdrant_profiles import COLLECTION_VERSION_KEY
+from app.services.embedding_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    embedding: np.ndarray
+    answer: str
+    created_at: float
+
+
+class AnswerCache:
+    """
+    Семантический кэш ответов на первые вопросы в диалоге.
+
+    Ищет ближайший по косинусному сходству прошлый вопрос и возвращает его ответ,
+    если сходство не ниже threshold. Кэш сбрасывается, когда меняется версия
+    коллекции в Qdrant (уроки загружены заново). Ответ кладется в кэш, только если
+    версия не сменилась с начала хода, иначе он посчитан по старым урокам.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        qdrant_client: AsyncQdrantClient,
+        collection_name: str,
+        max_size: int,
+        ttl: float,
+        threshold: float,
+        version_check_interval: float,
+    ):
+        self.embeddings = embeddings
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.version_check_interval = version_check_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self._entries: OrderedDict[str, CachedAnswer] = OrderedDict()
+        # Эмбеддинги вопросов построчно и ключи этих строк, пересобираются
+        # при изменении состава кэша; порядок LRU в _entries на них не влияет
+        self._matrix: np.ndarray | None = None
+        self._keys: list[str] = []
+        self._version: str | None = None
+        self._version_checked_at = 0.0
+
+    @property
+    def version(self) -> str | None:
+        """Версия коллекции, для которой сейчас хранятся ответы"""
+        return self._version
+
+    async def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(
+            await self.embeddings.aembed_query(question), dtype=np.float32
+        )
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    async def _check_version(self) -> None:
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = now
+
+        try:
+            collection = await self.qdrant_client.get_collection(self.collection_name)
+        except Exception as e:
+            logger.error(f"Error checking collection version: {e}")
+            return
+
+        version = (collection.config.metadata or {}).get(COLLECTION_VERSION_KEY)
+        if version != self._version:
+            if self._version is not None:
+                logger.info("Lesson collection changed, clearing answer cache")
+                self.invalidations += 1
+            self.clear()
+            self._version = version
+
+    def _evict_expired(self) -> None:
+        now = time.time()
+        expired = [
+            key
+            for key, entry in self._entries.items()
+            if now - entry.created_at > self.ttl
+        ]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    async def lookup(self, question: str) -> str | None:
+        await self._check_version()
+        self._evict_expired()
+
+        if not self._entries:
+            self.misses += 1
+            return None
+
+        query = await self._embed(question)
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = np.stack(
+                [entry.embedding for entry in self._entries.values()]
+            )
+
+        scores = self._matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        key = self._keys[best]
+        # Часто используемые ответы не должны вытесняться первыми
+        self._entries.move_to_end(key)
+        self.hits += 1
+        logger.info(
+            f"Answer cache hit (similarity {scores[best]:.3f}) for '{question}'"
+        )
+        return self._entries[key].answer
+
+    async def store(self, question: str, answer: str, version: str | None) -> None:
+        """version - версия коллекции на момент lookup в начале хода"""
+        if not answer:
+            return
+
+        embedding = await self._embed(question)
+        await self._check_version()
+        if version != self._version:
+            logger.info("Lesson collection changed during the turn, answer not cached")
+            return
+
+        key = normalize_query(question)
+        self._entries[key] = CachedAnswer(
+            embedding=embedding, answer=answer, created_at=time.time()
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._matrix = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Literal
+
+from app.core.config import settings
+from app.models.schemas import UserRequestType
+from app.services.metrics import CHAT_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# Событие хода агента (event, data), как в stream_agent_events
+TurnEvent = tuple[str, dict[str, Any]]
+
+
+@dataclass(frozen=True)
+class TurnMessage:
+    content: str  # текст для агента, с описанием картинки
+    query: str | None  # вопрос пользователя для кэша ответов и логов
+    request_type: UserRequestType
+    message_id: str | None = None  # ID сообщения у клиента для отсечения повторов
+
+
+# Выполняет ход агента по сообщениям пользователя и отдает его события
+TurnRunner = Callable[[list[TurnMessage]], AsyncIterator[TurnEvent]]
+
+
+@dataclass
+class _Turn:
+    run: TurnRunner
+    created_at: float
+    messages: list[TurnMessage]
+    events: list[TurnEvent] = field(default_factory=list)
+    started: bool = False
+    finished: bool = False
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    task: asyncio.Task | None = None
+    # Служебное действие с тредом (очистка истории): без окна merge, сообщения
+    # к нему не присоединяются
+    exclusive: bool = False
+
+    def notify(self) -> None:
+        # Будим всех подписчиков, следующие изменения ждут уже новое событие
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def publish(self, event: str, data: dict[str, Any]) -> None:
+        self.events.append((event, data))
+        self.notify()
+
+
+class ChatTurnController:
+    """
+    Ходы агента по тредам: одновременные запросы одного user_id не запускают
+    агента параллельно на одном чекпоинте.
+
+    - queue: каждое сообщение - отдельный ход, ходы треда идут по очереди;
+    - merge: ход ждет merge_window секунд с первого сообщения (и окончания
+      предыдущего хода), сообщения, пришедшие за это время, уходят агенту
+      одним ходом. Ответ получает последнее сообщение, остальные - событие merged.
+
+    Запрос с тем же message_id, что у сообщения еще не завершенного хода (повтор
+    клиента), не создает новый ход, а получает события хода этого сообщения.
+    Сообщения без message_id не отсеиваются.
+
+    run_exclusive ставит в ту же очередь действие с тредом (удаление истории),
+    чтобы оно не пересекалось с ходом агента, который допишет чекпоинт.
+    """
+
+    def __init__(
+        self,
+        policy: Literal["queue", "merge"],
+        merge_window: float,
+        merge_max_messages: int,
+    ):
+        self.policy = policy
+        self.merge_window = merge_window
+        self.merge_max_messages = merge_max_messages
+        # thread_id -> незавершенные ходы в порядке выполнения
+        self._threads: dict[str, list[_Turn]] = {}
+
+    def submit(
+        self, thread_id: str, message: TurnMessage, run: TurnRunner
+    ) -> AsyncIterator[TurnEvent]:
+        """Ставит сообщение в ход агента и возвращает события этого хода"""
+        turns = self._threads.setdefault(thread_id, [])
+
+        if message.message_id is not None:
+            for turn in turns:
+                for index, existing in enumerate(turn.messages):
+                    if existing.message_id == message.message_id:
+                        CHAT_MESSAGES.inc(outcome="duplicate")
+                        return self._follow(turn, index)
+
+        pending = turns[-1] if turns and not turns[-1].started else None
+        if (
+            self.policy == "merge"
+            and pending is not None
+            and not pending.exclusive
+            and len(pending.messages) < self.merge_max_messages
+        ):
+            pending.messages.append(message)
+            CHAT_MESSAGES.inc(outcome="merged")
+            return self._follow(pending, len(pending.messages) - 1)
+
+        turn = _Turn(run=run, created_at=time.monotonic(), messages=[message])
+        self._enqueue(thread_id, turn)
+        CHAT_MESSAGES.inc(outcome="new")
+        return self._follow(turn, 0)
+
+    async def run_exclusive(
+        self, thread_id: str, action: Callable[[], Awaitable[None]]
+    ) -> None:
+        """Выполняет action после всех поставленных ходов треда и до следующих"""
+
+        async def run(messages: list[TurnMessage]) -> AsyncIterator[TurnEvent]:
+            await action()
+            yield "done", {}
+
+        turn = _Turn(run=run, created_at=time.monotonic(), messages=[], exclusive=True)
+        self._enqueue(thread_id, turn)
+        async for event, data in self._follow(turn, 0):
+            if event == "error":
+                raise RuntimeError(data["detail"])
+
+    def _enqueue(self, thread_id: str, turn: _Turn) -> None:
+        turns = self._threads.setdefault(thread_id, [])
+        previous = turns[-1].task if turns else None
+        turn.task = asyncio.create_task(self._run(thread_id, turn, previous))
+        turns.append(turn)
+
+    async def _run(
+        self, thread_id: str, turn: _Turn, previous: asyncio.Task | None
+    ) -> None:
+        try:
+            if previous is not None:
+                # Ошибка предыдущего хода не мешает следующему
+                await asyncio.wait([previous])
+            if self.policy == "merge" and not turn.exclusive:
+                delay = turn.created_at + self.merge_window - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            # С этого момента список сообщений хода не меняется
+            turn.started = True
+            turn.notify()
+            async for event, data in turn.run(list(turn.messages)):
+                turn.publish(event, data)
+
+        except asyncio.CancelledError:
+            turn.publish("error", {"detail": "Server is shutting down"})
+            raise
+        except Exception as e:
+            logger.error(f"Error in agent turn for thread {thread_id}: {e}")
+            turn.publish("error", {"detail": str(e)})
+        finally:
+            turn.finished = True
+            turn.notify()
+            turns = self._threads[thread_id]
+            turns.remove(turn)
+            if not turns:
+                del self._threads[thread_id]
+
+    async def _follow(self, turn: _Turn, index: int) -> AsyncIterator[TurnEvent]:
+        """События хода с начала; для объединенных сообщений сначала merged"""
+        while not turn.started and not turn.finished:
+            await turn.changed.wait()
+        if turn.started and index < len(turn.messages) - 1:
+            yield "merged", {"messages": len(turn.messages)}
+
+        position = 0
+        while True:
+            while position < len(turn.events):
+                yield turn.events[position]
+                position += 1
+            if turn.finished:
+                return
+            await turn.changed.wait()
+
+    async def close(self) -> None:
+        tasks = [turn.task for turns in self._threads.values() for turn in turns]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def create_chat_turn_controller() -> ChatTurnController:
+    return ChatTurnController(
+        policy=settings.CHAT_CONCURRENCY_POLICY,
+        merge_window=settings.CHAT_MERGE_WINDOW,
+        merge_max_messages=settings.CHAT_MERGE_MAX_MESSAGES,
+    )
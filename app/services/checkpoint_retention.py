@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import time
+
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from app.core.checkpointer import create_checkpointer_pool
+from app.core.config import settings
+from app.services.embedding_cache import EmbeddingCacheStore, PersistentCacheStore
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock: при нескольких воркерах чистку выполняет только один
+RETENTION_LOCK_ID = 7_302_019
+
+# Следующая пачка тредов после thread_id = %(after)s. Идет по индексу первичного
+# ключа checkpoints (thread_id, checkpoint_ns, checkpoint_id) и читает только строки
+# этих тредов, поэтому запрос не упирается в statement_timeout на большой таблице
+THREAD_BATCH_SQL = """
+    SELECT DISTINCT thread_id
+    FROM checkpoints
+    WHERE thread_id > %(after)s
+    ORDER BY thread_id
+    LIMIT %(batch_size)s
+"""
+
+# Время последней записи в тред берем из поля ts самого чекпоинта
+IDLE_THREADS_SQL = f"""
+    WITH batch AS ({THREAD_BATCH_SQL})
+    SELECT c.thread_id,
+        max((c.checkpoint ->> 'ts')::timestamptz)
+            < now() - make_interval(secs => %(ttl)s) AS idle
+    FROM batch b
+    JOIN checkpoints c USING (thread_id)
+    GROUP BY c.thread_id
+    ORDER BY c.thread_id
+"""
+
+DELETE_THREADS_SQL = [
+    "DELETE FROM checkpoint_writes WHERE thread_id = ANY(%(thread_ids)s)",
+    "DELETE FROM checkpoint_blobs WHERE thread_id = ANY(%(thread_ids)s)",
+    "DELETE FROM checkpoints WHERE thread_id = ANY(%(thread_ids)s)",
+]
+
+# Треды, в которых старых чекпоинтов больше keep_last. Недавно активные треды
+# пропускаем, чтобы не пересекаться с записью нового чекпоинта
+THREADS_TO_COMPACT_SQL = f"""
+    WITH batch AS ({THREAD_BATCH_SQL})
+    SELECT c.thread_id, c.checkpoint_ns,
+        count(*) > %(keep_last)s
+            AND max((c.checkpoint ->> 'ts')::timestamptz)
+                < now() - make_interval(secs => %(min_idle)s) AS compact
+    FROM batch b
+    JOIN checkpoints c USING (thread_id)
+    GROUP BY c.thread_id, c.checkpoint_ns
+    ORDER BY c.thread_id
+"""
+
+# checkpoint_id - uuid6, поэтому сортировка по нему совпадает с порядком записи
+DELETE_OLD_CHECKPOINTS_SQL = """
+    WITH targets AS (
+        SELECT *
+        FROM unnest(%(thread_ids)s::text[], %(namespaces)s::text[])
+            AS t(thread_id, checkpoint_ns)
+    ), ranked AS (
+        SELECT c.thread_id, c.checkpoint_ns, c.checkpoint_id,
+            row_number() OVER (
+                PARTITION BY c.thread_id, c.checkpoint_ns
+                ORDER BY c.checkpoint_id DESC
+            ) AS rn
+        FROM checkpoints c
+        JOIN targets t USING (thread_id, checkpoint_ns)
+    ), deleted AS (
+        DELETE FROM checkpoints c
+        USING ranked r
+        WHERE c.thread_id = r.thread_id
+            AND c.checkpoint_ns = r.checkpoint_ns
+            AND c.checkpoint_id = r.checkpoint_id
+            AND r.rn > %(keep_last)s
+        RETURNING c.thread_id, c.checkpoint_ns, c.checkpoint_id
+    ), deleted_writes AS (
+        DELETE FROM checkpoint_writes w
+        USING deleted d
+        WHERE w.thread_id = d.thread_id
+            AND w.checkpoint_ns = d.checkpoint_ns
+            AND w.checkpoint_id = d.checkpoint_id
+    )
+    SELECT count(*) AS deleted FROM deleted
+"""
+
+# Значения каналов хранятся по версиям, удаляем версии, на которые
+# не ссылается ни один оставшийся чекпоинт
+DELETE_ORPHAN_BLOBS_SQL = """
+    DELETE FROM checkpoint_blobs b
+    USING unnest(%(thread_ids)s::text[], %(namespaces)s::text[])
+        AS t(thread_id, checkpoint_ns)
+    WHERE b.thread_id = t.thread_id
+        AND b.checkpoint_ns = t.checkpoint_ns
+        AND NOT EXISTS (
+            SELECT 1
+            FROM checkpoints c
+            WHERE c.thread_id = b.thread_id
+                AND c.checkpoint_ns = b.checkpoint_ns
+                AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+        )
+"""
+
+
+class CheckpointRetention:
+    """
+    Периодическая чистка таблиц чекпоинтера LangGraph.
+
+    - в каждом треде остаются только keep_last последних чекпоинтов
+      (агенту нужен только последний, история версий не используется);
+    - треды без активности дольше thread_ttl секунд удаляются целиком;
+    - из постоянных кэшей (cache_stores) удаляются записи старше их TTL.
+
+    Работа идет пачками по batch_size тредов, каждая пачка - отдельная короткая
+    транзакция с lock_timeout, чтобы не держать блокировки на горячих тредах.
+    """
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        interval: float,
+        keep_last: int,
+        thread_ttl: float | None,
+        min_idle: float,
+        batch_size: int,
+        lock_timeout_ms: int,
+        cache_stores: list[PersistentCacheStore] | None = None,
+    ):
+        self.pool = pool
+        self.interval = interval
+        self.keep_last = keep_last
+        self.thread_ttl = thread_ttl
+        self.min_idle = min_idle
+        self.batch_size = batch_size
+        self.lock_timeout_ms = lock_timeout_ms
+        self.cache_stores = cache_stores or []
+        self._task: asyncio.Task | None = None
+
+        self.runs = 0
+        self.deleted_threads = 0
+        self.deleted_checkpoints = 0
+        self.deleted_cache_rows = 0
+        self.last_run_seconds: float | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Error pruning checkpoints: {e}")
+
+    async def _begin(self, conn: AsyncConnection) -> None:
+        await conn.execute(
+            "SELECT set_config('lock_timeout', %s, true)",
+            (f"{self.lock_timeout_ms}ms",),
+        )
+
+    async def _delete_idle_threads(self, conn: AsyncConnection) -> int:
+        deleted = 0
+        after = ""
+        while True:
+            async with conn.transaction():
+                await self._begin(conn)
+                rows = await (
+                    await conn.execute(
+                        IDLE_THREADS_SQL,
+                        {
+                            "after": after,
+                            "ttl": self.thread_ttl,
+                            "batch_size": self.batch_size,
+                        },
+                    )
+                ).fetchall()
+                thread_ids = [row["thread_id"] for row in rows if row["idle"]]
+                if thread_ids:
+                    for sql in DELETE_THREADS_SQL:
+                        await conn.execute(sql, {"thread_ids": thread_ids})
+
+            deleted += len(thread_ids)
+            if len(rows) < self.batch_size:
+                return deleted
+            after = rows[-1]["thread_id"]
+
+    async def _compact_threads(self, conn: AsyncConnection) -> int:
+        deleted = 0
+        after = ""
+        while True:
+            async with conn.transaction():
+                await self._begin(conn)
+                rows = await (
+                    await conn.execute(
+                        THREADS_TO_COMPACT_SQL,
+                        {
+                            "after": after,
+                            "keep_last": self.keep_last,
+                            "min_idle": self.min_idle,
+                            "batch_size": self.batch_size,
+                        },
+                    )
+                ).fetchall()
+                targets = [row for row in rows if row["compact"]]
+                params = {
+                    "thread_ids": [row["thread_id"] for row in targets],
+                    "namespaces": [row["checkpoint_ns"] for row in targets],
+                    "keep_last": self.keep_last,
+                }
+                if targets:
+                    result = await (
+                        await conn.execute(DELETE_OLD_CHECKPOINTS_SQL, params)
+                    ).fetchone()
+                    await conn.execute(DELETE_ORPHAN_BLOBS_SQL, params)
+                    deleted += result["deleted"]
+
+            # Строки - по одной на (тред, namespace), пачка - по тредам
+            if len({row["thread_id"] for row in rows}) < self.batch_size:
+                return deleted
+            after = rows[-1]["thread_id"]
+
+    async def _prune_caches(self) -> int:
+        deleted = 0
+        for store in self.cache_stores:
+            try:
+                deleted += await store.prune(self.batch_size)
+            except Exception as e:
+                logger.error(f"Error pruning {store.name} cache: {e}")
+        return deleted
+
+    async def run_once(self) -> None:
+        started_at = time.monotonic()
+        async with self.pool.connection() as conn:
+            locked = await (
+                await conn.execute(
+                    "SELECT pg_try_advisory_lock(%s) AS locked", (RETENTION_LOCK_ID,)
+                )
+            ).fetchone()
+            if not locked["locked"]:
+                logger.info("Checkpoint retention is running in another process")
+                return
+
+            try:
+                threads = 0
+                if self.thread_ttl is not None:
+                    threads = await self._delete_idle_threads(conn)
+                checkpoints = await self._compact_threads(conn)
+                cache_rows = await self._prune_caches()
+            finally:
+                await conn.execute(
+                    "SELECT pg_advisory_unlock(%s)", (RETENTION_LOCK_ID,)
+                )
+
+        self.runs += 1
+        self.deleted_threads += threads
+        self.deleted_checkpoints += checkpoints
+        self.deleted_cache_rows += cache_rows
+        self.last_run_seconds = time.monotonic() - started_at
+        logger.info(
+            f"Checkpoint retention: deleted {threads} idle threads and "
+            f"{checkpoints} old checkpoints, {cache_rows} expired cache rows "
+            f"in {self.last_run_seconds:.1f}s"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "deleted_threads": self.deleted_threads,
+            "deleted_checkpoints": self.deleted_checkpoints,
+            "deleted_cache_rows": self.deleted_cache_rows,
+            "last_run_seconds": self.last_run_seconds,
+        }
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def create_checkpoint_retention(pool: AsyncConnectionPool) -> CheckpointRetention:
+    cache_stores = []
+    if settings.EMBEDDING_CACHE_PERSISTENT:
+        cache_stores.append(EmbeddingCacheStore(settings.EMBEDDING_CACHE_TTL))
+    return CheckpointRetention(
+        pool=pool,
+        interval=settings.CHECKPOINT_RETENTION_INTERVAL,
+        keep_last=settings.CHECKPOINT_KEEP_LAST,
+        thread_ttl=settings.CHECKPOINT_THREAD_TTL,
+        min_idle=settings.CHECKPOINT_RETENTION_MIN_IDLE,
+        batch_size=settings.CHECKPOINT_RETENTION_BATCH_SIZE,
+        lock_timeout_ms=settings.CHECKPOINT_RETENTION_LOCK_TIMEOUT_MS,
+        cache_stores=cache_stores,
+    )
+
+
+async def main():
+    """Разовый запуск чистки, например из cron вместо фоновой задачи в API"""
+    async with create_checkpointer_pool() as pool:
+        await create_checkpoint_retention(pool).run_once()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -1,26 +1,101 @@
-from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
 from app.models.chat_log import ChatLog
 from app.models.schemas import UserRequestType
 
+logger = logging.getLogger(__name__)
+
+# Сигнал фоновой задаче, что пора дописать очередь и завершиться
+_STOP = object()
+
 
-async def log_interaction(
-    db: AsyncSession,
-    user_id: str,
-    user_query: str,
-    ai_response: str,
-    request_type: UserRequestType = UserRequestType.text,
-):
+class ChatLogWriter:
     """
-    Записывает диалог в бд
+    Пишет диалоги в бд пачками.
+
+    Записи складываются в ограниченную очередь, фоновая задача забирает их
+    и вставляет одним multi-row INSERT, когда набралось batch_size записей
+    или прошло flush_interval секунд. Если очередь заполнена, log() ждет
+    (backpressure), при остановке очередь дописывается до конца.
     """
-    new_log = ChatLog(
-        user_id=user_id,
-        user_query=user_query,
-        ai_response=ai_response,
-        request_type=request_type,
-    )
-
-    db.add(new_log)
-    await db.commit()
-    await db.refresh(new_log)
-    return new_log
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        batch_size: int,
+        flush_interval: float,
+        max_queue_size: int,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def log(
+        self,
+        user_id: str,
+        user_query: str,
+        ai_response: str,
+        request_type: UserRequestType = UserRequestType.text,
+    ) -> None:
+        """
+        Записывает диалог в бд
+        """
+        await self.queue.put(
+            {
+                "user_id": user_id,
+                "user_query": user_query,
+                "ai_response": ai_response,
+                "request_type": request_type,
+                "created_at": datetime.now(),
+            }
+        )
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = await asyncio.wait_for(
+                        self.queue.get(), max(deadline - loop.time(), 0)
+                    )
+                except TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[dict]) -> None:
+        try:
+            async with self.session_factory() as session:
+                await session.execute(insert(ChatLog).values(batch))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} chat logs: {e}")
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        await self.queue.put(_STOP)
+        await self._task
+        self._task = None
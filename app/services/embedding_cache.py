@@ -0,0 +1,254 @@
+import hashlib
+import logging
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Any
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables.config import run_in_executor
+from langchain_qdrant.sparse_embeddings import SparseEmbeddings, SparseVector
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.database import Base, get_session_factory
+from app.models.embedding_cache import EmbeddingCacheEntry
+from app.services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """Приводит запрос к одному виду, чтобы одинаковые вопросы попадали в один ключ"""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class PersistentCacheStore:
+    """
+    Постоянный уровень кэша: таблица Postgres с первичным ключом key, колонкой
+    значения и created_at. Ошибки бд не ломают запрос - кэш просто промахивается.
+    Строки старше ttl секунд не читаются и удаляются в prune().
+    """
+
+    def __init__(
+        self,
+        model: type[Base],
+        value_column: str = "value",
+        hash_keys: bool = False,
+        ttl: float | None = None,
+    ):
+        self.model = model
+        self.value_column = getattr(model, value_column)
+        self.hash_keys = hash_keys
+        self.ttl = ttl
+        self.name = model.__tablename__
+
+    def _expires_before(self) -> datetime:
+        return datetime.now() - timedelta(seconds=self.ttl)
+
+    def _key(self, key: str) -> str:
+        if self.hash_keys:
+            return hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return key
+
+    async def get(self, key: str) -> Any | None:
+        query = select(self.value_column).where(self.model.key == self._key(key))
+        if self.ttl is not None:
+            query = query.where(self.model.created_at >= self._expires_before())
+        try:
+            async with get_session_factory()() as session:
+                return await session.scalar(query)
+        except Exception as e:
+            logger.error(f"Error reading {self.name} cache: {e}")
+            return None
+
+    async def set(self, key: str, value: Any) -> None:
+        try:
+            async with get_session_factory()() as session:
+                await session.execute(
+                    insert(self.model)
+                    .values({"key": self._key(key), self.value_column.key: value})
+                    .on_conflict_do_nothing(index_elements=[self.model.key])
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error writing {self.name} cache: {e}")
+
+    async def prune(self, batch_size: int) -> int:
+        """Удаляет устаревшие строки пачками по batch_size, возвращает их количество"""
+        if self.ttl is None:
+            return 0
+
+        expired = (
+            select(self.model.key)
+            .where(self.model.created_at < self._expires_before())
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        deleted = 0
+        while True:
+            async with get_session_factory()() as session:
+                result = await session.execute(
+                    delete(self.model).where(self.model.key.in_(expired))
+                )
+                await session.commit()
+            deleted += result.rowcount
+            if result.rowcount < batch_size:
+                return deleted
+
+
+class EmbeddingCacheStore(PersistentCacheStore):
+    """Постоянный уровень кэша эмбеддингов: таблица embedding_cache"""
+
+    def __init__(self, ttl: float | None = None):
+        super().__init__(EmbeddingCacheEntry, hash_keys=True, ttl=ttl)
+
+
+class TieredCache:
+    """LRU в памяти + опциональный постоянный уровень в Postgres"""
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float | None = None,
+        store: PersistentCacheStore | None = None,
+    ):
+        self.memory = LRUCache(max_size, ttl)
+        self.store = store
+        self.db_hits = 0
+
+    async def aget(self, key: str) -> Any | None:
+        value = self.memory.get(key)
+        if value is not None or self.store is None:
+            return value
+
+        value = await self.store.get(key)
+        if value is not None:
+            self.db_hits += 1
+            self.memory.set(key, value)
+        return value
+
+    async def aset(self, key: str, value: Any) -> None:
+        self.memory.set(key, value)
+        if self.store is not None:
+            await self.store.set(key, value)
+
+    def stats(self) -> dict:
+        stats = self.memory.stats()
+        # Промахи памяти, найденные в Postgres, считаем попаданиями
+        hits = stats["hits"] + self.db_hits
+        misses = stats["misses"] - self.db_hits
+        return {
+            **stats,
+            "db_hits": self.db_hits,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+
+class QueryCache(TieredCache):
+    """Кэш эмбеддингов запросов, общий формат ключей для dense и sparse"""
+
+    def __init__(
+        self,
+        namespace: str,
+        max_size: int,
+        ttl: float | None = None,
+        store: EmbeddingCacheStore | None = None,
+    ):
+        super().__init__(max_size, ttl, store)
+        self.namespace = namespace
+
+    def key(self, text: str) -> str:
+        return f"{self.namespace}:{normalize_query(text)}"
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Кэширует эмбеддинги поисковых запросов (embed_query), эмбеддинги документов
+    считаются как обычно.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: QueryCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        key = self.cache.key(text)
+        vector = self.cache.memory.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.memory.set(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        key = self.cache.key(text)
+        vector = await self.cache.aget(key)
+        if vector is not None:
+            self.cache.memory.set(key, vector)
+            return vector
+
+        vector = await self.embeddings.aembed_query(text)
+        self.cache.memory.set(key, vector)
+        if self.cache.store is not None:
+            await self.cache.store.set(key, vector)
+        return vector
+
+
+class CachedSparseEmbeddings(SparseEmbeddings):
+    """То же для sparse (BM25) эмбеддингов"""
+
+    def __init__(self, sparse_embeddings: SparseEmbeddings, cache: QueryCache):
+        self.sparse_embeddings = sparse_embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[SparseVector]:
+        return self.sparse_embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> SparseVector:
+        key = self.cache.key(text)
+        vector = self.cache.memory.get(key)
+        if vector is None:
+            vector = self.sparse_embeddings.embed_query(text)
+            self.cache.memory.set(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> SparseVector:
+        key = self.cache.key(text)
+        vector = await self.cache.aget(key)
+        if vector is not None:
+            vector = SparseVector.model_validate(vector)
+            self.cache.memory.set(key, vector)
+            return vector
+
+        # FastEmbed работает синхронно, поэтому выносим из event loop
+        vector = await run_in_executor(None, self.sparse_embeddings.embed_query, text)
+        self.cache.memory.set(key, vector)
+        if self.cache.store is not None:
+            await self.cache.store.set(key, vector.model_dump())
+        return vector
+
+
+def with_query_cache(
+    embeddings: Embeddings,
+    sparse_embeddings: SparseEmbeddings,
+    dense_namespace: str,
+    sparse_namespace: str,
+    max_size: int,
+    ttl: float | None = None,
+    persistent: bool = False,
+) -> tuple[CachedEmbeddings, CachedSparseEmbeddings]:
+    """Оборачивает dense и sparse эмбеддинги в кэш запросов"""
+    store = EmbeddingCacheStore(ttl) if persistent else None
+    return (
+        CachedEmbeddings(embeddings, QueryCache(dense_namespace, max_size, ttl, store)),
+        CachedSparseEmbeddings(
+            sparse_embeddings, QueryCache(sparse_namespace, max_size, ttl, store)
+        ),
+    )
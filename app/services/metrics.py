@@ -0,0 +1,262 @@
+import bisect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Границы корзин гистограмм, секунды
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+# Длительности этапов текущего запроса (этап -> секунды) для заголовка Server-Timing
+_request_timings: ContextVar[dict[str, float] | None] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """Счетчик в формате Prometheus с набором меток"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for key, value in sorted(self._values.items()):
+            labels = _format_labels(dict(zip(self.labelnames, key)))
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: накопительные корзины, сумма и количество"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...],
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # метки -> (счетчики по корзинам + корзина +Inf, сумма)
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[key] = (counts, total + value)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, (counts, total) in sorted(self._values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = _format_labels({**labels, "le": str(bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "rag_request_duration_seconds",
+    "HTTP request duration until the last body chunk",
+    ("method", "path", "status"),
+)
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Duration of a request processing stage",
+    ("stage",),
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total",
+    "Tokens reported by the LLM API",
+    ("stage", "model", "type"),
+)
+CHAT_MESSAGES = Counter(
+    "rag_chat_messages_total",
+    "Chat messages by how they were scheduled: new agent turn, merged or duplicate",
+    ("outcome",),
+)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """
+    Время этапа попадает в гистограмму STAGE_SECONDS и, внутри HTTP запроса,
+    в его заголовок Server-Timing. Повторные этапы одного запроса
+    (несколько вызовов LLM) суммируются.
+    """
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """Замеряет блок кода как этап обработки запроса"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started_at)
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Время и токены вызовов LLM без LangSmith. Передается в callbacks модели,
+    stage - название этапа (llm, vision, hyde, history_summary).
+    """
+
+    # Выполняется в event loop, а не в пуле потоков, чтобы видеть контекст запроса
+    run_inline = True
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._started: dict[UUID, float] = {}
+
+    def on_chat_model_start(
+        self, serialized: dict[str, Any], messages: list, *, run_id: UUID, **kwargs
+    ) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(
+        self, serialized: dict[str, Any], prompts: list[str], *, run_id: UUID, **kwargs
+    ) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def _finish(self, run_id: UUID) -> None:
+        started_at = self._started.pop(run_id, None)
+        if started_at is not None:
+            record_stage(self.stage, time.perf_counter() - started_at)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        self._finish(run_id)
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if not usage:
+                    continue
+                model = message.response_metadata.get("model_name", "unknown")
+                for token_type in ("input_tokens", "output_tokens"):
+                    LLM_TOKENS.inc(
+                        usage.get(token_type, 0),
+                        stage=self.stage,
+                        model=model,
+                        type=token_type.removesuffix("_tokens"),
+                    )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._finish(run_id)
+
+
+def format_server_timing(timings: dict[str, float]) -> str:
+    return ", ".join(
+        f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+    )
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: длительность запросов и заголовок Server-Timing с этапами.
+
+    Для стриминговых ответов заголовки уходят до ответа модели, поэтому в
+    Server-Timing попадают только этапы до начала стрима (загрузка файла,
+    транскрибация, кэш ответов), полное время - в гистограммах /metrics.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: dict[str, float] = {}
+        token = _request_timings.set(timings)
+        started_at = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if timings:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", format_server_timing(timings))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            # Шаблон пути, а не сам путь, чтобы не плодить метки
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started_at,
+                method=scope["method"],
+                path=getattr(route, "path", "unmatched"),
+                status=str(status_code),
+            )
+
+
+def render_metrics(caches: dict[str, Any]) -> str:
+    """Все метрики в текстовом формате Prometheus, включая счетчики кэшей"""
+    lines = [
+        *REQUEST_SECONDS.render(),
+        *STAGE_SECONDS.render(),
+        *LLM_TOKENS.render(),
+        *CHAT_MESSAGES.render(),
+    ]
+
+    cache_stats = {name: cache.stats() for name, cache in caches.items()}
+    for metric, field, metric_type, documentation in (
+        ("rag_cache_hits_total", "hits", "counter", "Cache hits"),
+        ("rag_cache_misses_total", "misses", "counter", "Cache misses"),
+        ("rag_cache_hit_rate", "hit_rate", "gauge", "Cache hit rate"),
+    ):
+        lines.append(f"# HELP {metric} {documentation}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for name, stats in sorted(cache_stats.items()):
+            lines.append(f"{metric}{_format_labels({'cache': name})} {stats[field]}")
+
+    return "\n".join(lines) + "\n"
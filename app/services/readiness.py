@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable
+
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant.sparse_embeddings import SparseEmbeddings
+from psycopg_pool import AsyncConnectionPool
+from qdrant_client import AsyncQdrantClient
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.core.database import get_engine
+from app.services.agent.rerank import Reranker
+from app.services.agent.tools.messages import count_tokens
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TEXT = "Чем отличаются частицы 은/는 и 이/가?"
+
+
+async def _timed(name: str, check: Awaitable[Any], timeout: float) -> tuple[str, dict]:
+    """
+    Выполняет проверку с таймаутом и возвращает результат с ее длительностью.
+    Если проверка вернула dict, он добавляется к результату
+    """
+    started_at = time.perf_counter()
+    try:
+        detail = await asyncio.wait_for(check, timeout)
+        result = {"ok": True}
+        if isinstance(detail, dict):
+            result.update(detail)
+    except Exception as e:
+        result = {"ok": False, "error": str(e) or type(e).__name__}
+    result["latency_ms"] = round((time.perf_counter() - started_at) * 1000, 1)
+    return name, result
+
+
+async def _probe_postgres() -> None:
+    async with get_engine().connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def _probe_checkpointer(pool: AsyncConnectionPool) -> dict:
+    async with pool.connection() as conn:
+        await conn.execute("SELECT 1")
+    return {"pool_available": pool.get_stats().get("pool_available", 0)}
+
+
+async def _probe_qdrant(client: AsyncQdrantClient) -> dict:
+    # count работает и по алиасу, на который указывает QDRANT_COLLECTION_NAME
+    result = await client.count(settings.QDRANT_COLLECTION_NAME, exact=False)
+    return {"points": result.count}
+
+
+async def check_readiness(
+    pool: AsyncConnectionPool, qdrant_client: AsyncQdrantClient
+) -> dict[str, dict]:
+    """Параллельно проверяет Postgres, пул чекпоинтера и Qdrant"""
+    timeout = settings.READINESS_PROBE_TIMEOUT
+    results = await asyncio.gather(
+        _timed("postgres", _probe_postgres(), timeout),
+        _timed("checkpointer", _probe_checkpointer(pool), timeout),
+        _timed("qdrant", _probe_qdrant(qdrant_client), timeout),
+    )
+    return dict(results)
+
+
+async def warmup(
+    pool: AsyncConnectionPool,
+    qdrant_client: AsyncQdrantClient,
+    embeddings: Embeddings,
+    sparse_embeddings: SparseEmbeddings,
+    reranker: Reranker | None = None,
+) -> dict[str, dict]:
+    """
+    Прогрев перед приемом трафика: соединения пулов Postgres и Qdrant,
+    первый вызов BM25 (ONNX сессия), словарь tiktoken, кросс-энкодер и,
+    если включено, соединение с OpenAI. Ошибки прогрева не останавливают
+    запуск - их покажет /ready.
+    """
+    timeout = settings.WARMUP_TIMEOUT
+    steps = {
+        "checkpointer_pool": pool.wait(timeout=timeout),
+        "postgres": _probe_postgres(),
+        "qdrant": _probe_qdrant(qdrant_client),
+        "sparse_model": asyncio.to_thread(sparse_embeddings.embed_query, WARMUP_TEXT),
+        "tokenizer": asyncio.to_thread(count_tokens, WARMUP_TEXT),
+    }
+    if reranker is not None:
+        steps["reranker"] = reranker.warmup(WARMUP_TEXT, settings.RERANK_CANDIDATES)
+    if settings.WARMUP_OPENAI:
+        # Один запрос эмбеддинга открывает TLS соединение с OpenAI заранее
+        steps["openai"] = embeddings.aembed_query(WARMUP_TEXT)
+
+    started_at = time.perf_counter()
+    results = dict(
+        await asyncio.gather(
+            *(_timed(name, step, timeout) for name, step in steps.items())
+        )
+    )
+    elapsed = time.perf_counter() - started_at
+
+    failed = [name for name, result in results.items() if not result["ok"]]
+    if failed:
+        logger.warning(f"Warmup steps failed: {failed}")
+    logger.info(f"Warmup finished in {elapsed:.1f}s: {results}")
+    return results
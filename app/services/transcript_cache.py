@@ -0,0 +1,29 @@
+import hashlib
+
+from app.models.transcript import Transcript
+from app.services.embedding_cache import PersistentCacheStore, TieredCache
+
+
+def transcript_cache_key(
+    content: bytes | None = None, audio_id: str | None = None
+) -> str:
+    """
+    Ключ кэша: file_unique_id из Telegram (одинаковый для пересланных голосовых),
+    иначе sha256 содержимого файла.
+    """
+    if audio_id:
+        return f"tg:{audio_id}"
+    if content is None:
+        raise ValueError("Audio content or audio_id is required")
+    return hashlib.sha256(content).hexdigest()
+
+
+class TranscriptCache(TieredCache):
+    """
+    Кэш транскрипций: LRU в памяти и, опционально, таблица transcripts в Postgres,
+    которая переживает рестарты и общая для всех воркеров.
+    """
+
+    def __init__(self, max_size: int, persistent: bool = False):
+        store = PersistentCacheStore(Transcript, value_column="text")
+        super().__init__(max_size, store=store if persistent else None)
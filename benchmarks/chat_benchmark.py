@@ -0,0 +1,602 @@
+"""
+Офлайн бенчмарк API: приложение FastAPI запускается в том же процессе,
+запросы идут через httpx.ASGITransport с заданной конкурентностью.
+
+OpenAI заменен детерминированными фейками (benchmarks/fakes.py) с настраиваемой
+задержкой, Qdrant работает в режиме :memory: с уроками из lessons_clean.md,
+чекпоинтер и логи диалогов пишутся в локальный Postgres (настройки POSTGRES_*,
+нужны миграции alembic) или, с --storage memory, в память.
+
+    python -m benchmarks.chat_benchmark --endpoint text --requests 200 --concurrency 16
+
+Результат каждого прогона можно дописывать в JSONL (--output), чтобы следить
+за изменениями задержки от коммита к коммиту.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import subprocess
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import httpx
+import numpy as np
+from fastapi import FastAPI
+from langchain_qdrant import FastEmbedSparse, QdrantVectorStore, RetrievalMode
+from langgraph.checkpoint.memory import InMemorySaver
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+
+from app.core.checkpointer import (
+    create_checkpointer,
+    create_checkpointer_pool,
+    create_serializer,
+)
+from app.core.config import settings
+from app.core.database import get_session_factory
+from app.core.qdrant_profiles import get_qdrant_profile
+from app.routers import chat, health, metrics
+from app.services.agent.audio import TranscriptionService
+from app.services.agent.rag_agent import build_rag_agent, build_retrieve_docs_tool
+from app.services.agent.rerank import create_reranker
+from app.services.chat_turns import ChatTurnController
+from app.services.db_service import ChatLogWriter
+from app.services.embedding_cache import with_query_cache
+from app.services.metrics import LLMMetricsCallback, MetricsMiddleware
+from app.services.transcript_cache import TranscriptCache
+from benchmarks.fakes import (
+    FakeChatModel,
+    FakeEmbeddings,
+    FakeOpenAIClient,
+    NullChatLogWriter,
+    StageTimings,
+)
+from data_pipeline.offline_vector_ingestion import load_chunks
+
+logger = logging.getLogger(__name__)
+
+ENDPOINTS = ("text", "text_stream", "audio", "audio_stream", "retrieve")
+PERCENTILES = (50, 95, 99)
+UPSERT_BATCH_SIZE = 256
+# Период проверки задержки event loop
+LOOP_LAG_INTERVAL = 0.01  # секунды
+
+QUESTIONS = [
+    "Чем отличаются частицы 은/는 и 이/가?",
+    "Как образуется прошедшее время глаголов?",
+    "Когда используется окончание -아요/-어요?",
+    "Как сказать 'хочу' по-корейски?",
+    "Что означает конструкция -(으)ㄹ 수 있다?",
+    "Как правильно использовать частицу 에서?",
+    "Чем отличается 안 от 못?",
+    "Как построить вопросительное предложение?",
+    "Как считать предметы корейскими числительными?",
+    "Что такое вежливый стиль -(스)ㅂ니다?",
+]
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """Перцентили в миллисекундах"""
+    if not values:
+        return {}
+    result = np.percentile(np.array(values) * 1000, PERCENTILES)
+    return {f"p{q}": round(float(v), 2) for q, v in zip(PERCENTILES, result)} | {
+        "max": round(max(values) * 1000, 2)
+    }
+
+
+class LoopLagMonitor:
+    """Замеряет, насколько позже запланированного просыпается задача в event loop"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(
+                max(time.perf_counter() - started_at - self.interval, 0.0)
+            )
+
+    def start(self) -> None:
+        self.samples.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def load_lessons(
+    client: AsyncQdrantClient,
+    embeddings: FakeEmbeddings,
+    sparse_embeddings: FastEmbedSparse,
+) -> int:
+    """Создает коллекцию в Qdrant :memory: и загружает в нее чанки уроков"""
+    profile = get_qdrant_profile(settings.QDRANT_PROFILE)
+    await client.create_collection(
+        collection_name=settings.QDRANT_COLLECTION_NAME,
+        vectors_config={
+            settings.VECTOR_NAME: profile.vector_params(size=embeddings.size)
+        },
+        sparse_vectors_config={
+            settings.SPARSE_VECTOR_NAME: profile.sparse_vector_params()
+        },
+    )
+
+    chunks = list(load_chunks().items())
+    for i in range(0, len(chunks), UPSERT_BATCH_SIZE):
+        batch = chunks[i : i + UPSERT_BATCH_SIZE]
+        texts = [doc.page_content for _, doc in batch]
+        dense = embeddings.embed_documents(texts)
+        sparse = await asyncio.to_thread(sparse_embeddings.embed_documents, texts)
+        await client.upsert(
+            collection_name=settings.QDRANT_COLLECTION_NAME,
+            points=[
+                models.PointStruct(
+                    id=point_id,
+                    vector={
+                        settings.VECTOR_NAME: dense_vector,
+                        settings.SPARSE_VECTOR_NAME: models.SparseVector(
+                            indices=sparse_vector.indices,
+                            values=sparse_vector.values,
+                        ),
+                    },
+                    payload={
+                        QdrantVectorStore.CONTENT_KEY: doc.page_content,
+                        QdrantVectorStore.METADATA_KEY: doc.metadata,
+                    },
+                )
+                for (point_id, doc), dense_vector, sparse_vector in zip(
+                    batch, dense, sparse
+                )
+            ],
+        )
+    return len(chunks)
+
+
+@asynccontextmanager
+async def create_storage(storage: str):
+    """Чекпоинтер и запись логов: локальный Postgres или память"""
+    if storage == "memory":
+        yield None, InMemorySaver(serde=create_serializer()), NullChatLogWriter()
+        return
+
+    async with create_checkpointer_pool() as pool:
+        checkpointer = create_checkpointer(pool)
+        await checkpointer.setup()
+        chat_log_writer = ChatLogWriter(
+            session_factory=get_session_factory(),
+            batch_size=settings.CHAT_LOG_BATCH_SIZE,
+            flush_interval=settings.CHAT_LOG_FLUSH_INTERVAL,
+            max_queue_size=settings.CHAT_LOG_QUEUE_SIZE,
+        )
+        yield pool, checkpointer, chat_log_writer
+
+
+def create_app(args: argparse.Namespace, timings: StageTimings) -> FastAPI:
+    """Те же роутеры, что в app.main, но зависимости в lifespan заменены фейками"""
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        async with create_storage(args.storage) as (
+            pool,
+            checkpointer,
+            chat_log_writer,
+        ):
+            qdrant_client = AsyncQdrantClient(location=":memory:")
+            embeddings, sparse_embeddings = with_query_cache(
+                FakeEmbeddings(latency=args.embedding_latency),
+                FastEmbedSparse(model_name=settings.SPARSE_MODEL),
+                dense_namespace="fake-embeddings",
+                sparse_namespace=settings.SPARSE_MODEL,
+                max_size=settings.EMBEDDING_CACHE_SIZE,
+                ttl=settings.EMBEDDING_CACHE_TTL,
+                persistent=(
+                    settings.EMBEDDING_CACHE_PERSISTENT and args.storage == "postgres"
+                ),
+            )
+            chunks = await load_lessons(
+                qdrant_client, embeddings.embeddings, sparse_embeddings.sparse_embeddings
+            )
+            logger.info(f"Loaded {chunks} lesson chunks into in-memory Qdrant")
+
+            # Синхронный клиент нужен QdrantVectorStore только как контейнер,
+            # поиск идет через асинхронный клиент
+            vector_store = QdrantVectorStore(
+                client=QdrantClient(location=":memory:"),
+                collection_name=settings.QDRANT_COLLECTION_NAME,
+                embedding=embeddings,
+                sparse_embedding=sparse_embeddings,
+                retrieval_mode=RetrievalMode.HYBRID,
+                vector_name=settings.VECTOR_NAME,
+                sparse_vector_name=settings.SPARSE_VECTOR_NAME,
+                validate_collection_config=False,
+            )
+            reranker = await asyncio.to_thread(create_reranker)
+
+            chat_model = FakeChatModel(
+                latency=args.model_latency,
+                token_latency=args.token_latency,
+                answer_tokens=args.answer_tokens,
+                timings=timings,
+                callbacks=[LLMMetricsCallback("llm")],
+            )
+            helper_model = FakeChatModel(
+                latency=args.model_latency,
+                token_latency=args.token_latency,
+                answer_tokens=args.answer_tokens // 2,
+                timings=timings,
+                stage="helper_model",
+                callbacks=[LLMMetricsCallback("helper_model")],
+            )
+
+            app.state.checkpointer_pool = pool
+            app.state.checkpointer = checkpointer
+            app.state.qdrant_client = qdrant_client
+            app.state.reranker = reranker
+            app.state.vision_model = FakeChatModel(
+                latency=args.model_latency,
+                answer_tokens=args.answer_tokens // 2,
+                timings=timings,
+                stage="vision",
+                callbacks=[LLMMetricsCallback("vision")],
+            )
+            app.state.rag_agent = build_rag_agent(
+                checkpointer,
+                qdrant_client,
+                reranker=reranker,
+                chat_model=chat_model,
+                helper_model=helper_model,
+                vector_store=vector_store,
+            )
+            app.state.retrieve_docs = build_retrieve_docs_tool(
+                vector_store, qdrant_client, reranker=reranker
+            )
+            app.state.transcription_service = TranscriptionService(
+                FakeOpenAIClient(QUESTIONS, latency=args.transcription_latency),
+                TranscriptCache(max_size=settings.TRANSCRIPT_CACHE_SIZE),
+            )
+            app.state.caches = {
+                "transcripts": app.state.transcription_service.cache,
+                "query_embeddings_dense": embeddings.cache,
+                "query_embeddings_sparse": sparse_embeddings.cache,
+            }
+            app.state.chat_log_writer = chat_log_writer
+            app.state.turn_controller = ChatTurnController(
+                policy=args.turn_policy,
+                merge_window=args.merge_window,
+                merge_max_messages=settings.CHAT_MERGE_MAX_MESSAGES,
+            )
+
+            timings.instrument(checkpointer, "aget_tuple", "checkpoint_read")
+            timings.instrument(checkpointer, "aput", "checkpoint_write")
+            timings.instrument(checkpointer, "aput_writes", "checkpoint_write")
+            timings.instrument(embeddings, "aembed_query", "embed_dense")
+            timings.instrument(sparse_embeddings, "aembed_query", "embed_sparse")
+            timings.instrument(qdrant_client, "query_points", "qdrant_query")
+            timings.instrument(
+                app.state.transcription_service, "transcribe", "transcription"
+            )
+            timings.instrument(chat_log_writer, "log", "chat_log")
+            if reranker:
+                timings.instrument(reranker, "rerank", "rerank")
+
+            chat_log_writer.start()
+            try:
+                yield
+            finally:
+                await app.state.turn_controller.close()
+                await chat_log_writer.close()
+                await qdrant_client.close()
+                if reranker:
+                    reranker.close()
+
+    app = FastAPI(title="Benchmark", lifespan=lifespan)
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(health.router)
+    app.include_router(metrics.router)
+    # Без проверки API ключа: бенчмарк меряет обработку запроса, а не авторизацию
+    app.include_router(chat.router)
+    return app
+
+
+async def stream_request(app: FastAPI, request: httpx.Request) -> float | None:
+    """
+    Вызывает стриминговый эндпоинт как ASGI приложение напрямую и возвращает
+    момент первого токена. httpx.ASGITransport отдает тело ответа только
+    целиком, поэтому время до первого токена через него не измерить.
+    """
+    body = await request.aread()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": request.method,
+        "scheme": request.url.scheme,
+        "path": request.url.path,
+        "raw_path": request.url.raw_path,
+        "query_string": request.url.query,
+        "root_path": "",
+        # ASGI требует имена заголовков в нижнем регистре
+        "headers": [(key.lower(), value) for key, value in request.headers.raw],
+        "client": ("127.0.0.1", 0),
+        "server": (request.url.host, 80),
+    }
+    body_sent = False
+    first_token_at = None
+    status_code = None
+    error = False
+
+    async def receive() -> dict:
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Клиент не отключается, ждем, пока Starlette отменит слушателя
+        await asyncio.Event().wait()
+
+    async def send(message: dict) -> None:
+        nonlocal first_token_at, status_code, error
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body":
+            chunk = message.get("body", b"")
+            if b"event: error" in chunk:
+                error = True
+            if first_token_at is None and (
+                b"event: token" in chunk or b"event: done" in chunk
+            ):
+                first_token_at = time.perf_counter()
+
+    await app(scope, receive, send)
+    if status_code != 200 or error:
+        raise RuntimeError(f"Stream failed with status {status_code}")
+    return first_token_at
+
+
+async def send_request(
+    client: httpx.AsyncClient,
+    app: FastAPI,
+    args: argparse.Namespace,
+    user_id: str,
+    i: int,
+) -> float | None:
+    """Один запрос к эндпоинту. Для стриминга возвращает момент первого токена"""
+    question = QUESTIONS[i % len(QUESTIONS)]
+    if args.unique_questions:
+        # Каждый вопрос новый, кэши эмбеддингов не помогают
+        question = f"{question} ({i})"
+
+    endpoint = args.endpoint
+    if endpoint == "retrieve":
+        await app.state.retrieve_docs.ainvoke({"query": question})
+        return None
+
+    if endpoint.startswith("audio"):
+        # Уникальное содержимое на каждый запрос, чтобы не попадать в кэш транскрипций
+        audio = f"OggS benchmark audio {user_id} {i}".encode()
+        kwargs = {
+            "data": {"user_id": user_id},
+            "files": {"audio": ("voice.ogg", audio, "audio/ogg")},
+        }
+    else:
+        kwargs = {"data": {"user_id": user_id, "question": question}}
+
+    path = "/chat/" + endpoint.replace("_", "/")
+    if endpoint.endswith("stream"):
+        return await stream_request(app, client.build_request("POST", path, **kwargs))
+
+    response = await client.post(path, **kwargs)
+    response.raise_for_status()
+    return None
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    app: FastAPI,
+    args: argparse.Namespace,
+    total: int,
+    user_ids: list[str],
+) -> dict:
+    """total запросов в concurrency параллельных воркерах"""
+    counter = itertools.count()
+    latencies: list[float] = []
+    first_tokens: list[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while (i := next(counter)) < total:
+            started_at = time.perf_counter()
+            try:
+                first_token_at = await send_request(
+                    client, app, args, user_ids[i % len(user_ids)], i
+                )
+            except Exception as e:
+                errors += 1
+                logger.error(f"Benchmark request {i} failed: {e}")
+                continue
+            latencies.append(time.perf_counter() - started_at)
+            if first_token_at is not None:
+                first_tokens.append(first_token_at - started_at)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started_at
+    return {
+        "latencies": latencies,
+        "first_tokens": first_tokens,
+        "errors": errors,
+        "elapsed": elapsed,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def build_report(
+    args: argparse.Namespace,
+    result: dict,
+    loop_lag: list[float],
+    timings: StageTimings,
+    caches: dict,
+) -> dict:
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "params": {
+            "endpoint": args.endpoint,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "users": args.users,
+            "unique_questions": args.unique_questions,
+            "storage": args.storage,
+            "model_latency": args.model_latency,
+            "token_latency": args.token_latency,
+            "answer_tokens": args.answer_tokens,
+            "embedding_latency": args.embedding_latency,
+            "transcription_latency": args.transcription_latency,
+            "agent_mode": settings.AGENT_MODE,
+            "rerank": settings.RERANK_ENABLED,
+            "turn_policy": args.turn_policy,
+        },
+        "completed": len(result["latencies"]),
+        "errors": result["errors"],
+        "elapsed_seconds": round(result["elapsed"], 3),
+        "requests_per_second": round(len(result["latencies"]) / result["elapsed"], 2),
+        "latency_ms": percentiles(result["latencies"]),
+        "first_token_ms": percentiles(result["first_tokens"]),
+        "event_loop_lag_ms": percentiles(loop_lag),
+        "stages_ms": {
+            stage: {
+                "calls": len(samples),
+                "mean": round(float(np.mean(samples)) * 1000, 2),
+                **percentiles(samples),
+            }
+            for stage, samples in sorted(timings.samples.items())
+        },
+        "cache_hit_rates": {
+            name: round(cache.stats()["hit_rate"], 3) for name, cache in caches.items()
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    def line(values: dict) -> str:
+        return "  ".join(f"{key}={value}" for key, value in values.items()) or "-"
+
+    print(f"\nparams: {line(report['params'])}")
+    print(
+        f"completed={report['completed']} errors={report['errors']} "
+        f"elapsed={report['elapsed_seconds']}s rps={report['requests_per_second']}"
+    )
+    print(f"latency ms:         {line(report['latency_ms'])}")
+    print(f"first token ms:     {line(report['first_token_ms'])}")
+    print(f"event loop lag ms:  {line(report['event_loop_lag_ms'])}")
+    print("stages ms:")
+    for stage, stats in report["stages_ms"].items():
+        print(f"  {stage:<18} {line(stats)}")
+    print(f"cache hit rates:    {line(report['cache_hit_rates'])}")
+
+
+async def main(args: argparse.Namespace) -> dict:
+    timings = StageTimings()
+    app = create_app(args, timings)
+    run_id = uuid.uuid4().hex[:8]
+    user_ids = [f"bench-{run_id}-{i}" for i in range(args.users)]
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark", timeout=None
+        ) as client:
+            if args.warmup:
+                await run_load(client, app, args, args.warmup, user_ids)
+                timings.clear()
+
+            monitor = LoopLagMonitor()
+            monitor.start()
+            try:
+                result = await run_load(client, app, args, args.requests, user_ids)
+            finally:
+                await monitor.stop()
+
+        report = build_report(args, result, monitor.samples, timings, app.state.caches)
+
+        # Треды бенчмарка не должны оставаться в Postgres
+        for user_id in user_ids:
+            await app.state.checkpointer.adelete_thread(user_id)
+
+    return report
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline API benchmark")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, default="text")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--users", type=int, default=50, help="distinct chat threads"
+    )
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument(
+        "--unique-questions",
+        action="store_true",
+        help="make every question unique to bypass the query embedding cache",
+    )
+    parser.add_argument("--storage", choices=("postgres", "memory"), default="postgres")
+    parser.add_argument(
+        "--turn-policy",
+        choices=("queue", "merge"),
+        default=settings.CHAT_CONCURRENCY_POLICY,
+        help="how concurrent messages of one thread are scheduled",
+    )
+    parser.add_argument(
+        "--merge-window", type=float, default=settings.CHAT_MERGE_WINDOW
+    )
+    parser.add_argument(
+        "--model-latency", type=float, default=0.3, help="seconds to first token"
+    )
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--transcription-latency", type=float, default=0.5)
+    parser.add_argument("--output", help="append the JSON report to this JSONL file")
+    parser.add_argument(
+        "--log-file",
+        default="/dev/null",
+        help="application logs are written here to keep their cost in the numbers",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # force: модули приложения уже настроили логирование в консоль при импорте
+    logging.basicConfig(level=logging.INFO, filename=args.log_file, force=True)
+
+    report = asyncio.run(main(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+import json
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Iterator
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    HumanMessage,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from app.services.agent.tools.messages import count_tokens
+
+# Слова для детерминированного ответа модели
+ANSWER_WORDS = (
+    "В этой конструкции частица указывает на тему предложения, а окончание "
+    "глагола зависит от уровня вежливости и времени действия"
+).split()
+
+
+class StageTimings:
+    """Длительности этапов обработки запроса: этап -> список длительностей в секундах"""
+
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def clear(self) -> None:
+        self.samples.clear()
+
+    def instrument(self, obj: Any, method_name: str, stage: str) -> None:
+        """Подменяет async метод объекта оберткой, которая замеряет время вызова"""
+        method = getattr(obj, method_name)
+
+        async def timed(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started_at)
+
+        # Экземпляры pydantic (инструменты LangChain) не дают просто присвоить атрибут
+        object.__setattr__(obj, method_name, timed)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Детерминированная замена ChatOpenAI.
+
+    Если модели переданы инструменты и последнее сообщение - вопрос пользователя,
+    модель вызывает retrieve_docs с текстом вопроса. После ответа инструмента
+    (или без инструментов) возвращает ответ из answer_tokens слов.
+    Задержка до первого токена и между токенами имитирует OpenAI API.
+    """
+
+    latency: float = 0.3
+    token_latency: float = 0.005
+    answer_tokens: int = 60
+    tool_names: list[str] = []
+    timings: Any = None
+    stage: str = "model"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def bind_tools(self, tools, **kwargs):
+        names = [getattr(tool, "name", None) or tool["name"] for tool in tools]
+        return self.model_copy(update={"tool_names": names})
+
+    def _reply(self, messages: list[BaseMessage]) -> AIMessage:
+        last_message = messages[-1]
+        input_tokens = sum(count_tokens(message.text) for message in messages)
+
+        if "retrieve_docs" in self.tool_names and isinstance(
+            last_message, HumanMessage
+        ):
+            message = AIMessage(
+                content="",
+                tool_calls=[
+                    {
+                        "name": "retrieve_docs",
+                        "args": {"query": last_message.text},
+                        "id": f"call_{zlib.crc32(last_message.text.encode()):08x}",
+                    }
+                ],
+            )
+            output_tokens = 20
+        else:
+            # Длина ответа не зависит от контекста, чтобы прогоны были сравнимы
+            seed = zlib.crc32(last_message.text.encode())
+            words = [
+                ANSWER_WORDS[(seed + i) % len(ANSWER_WORDS)]
+                for i in range(self.answer_tokens)
+            ]
+            message = AIMessage(content=" ".join(words))
+            output_tokens = self.answer_tokens
+
+        message.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        return message
+
+    def _record(self, started_at: float) -> None:
+        if self.timings is not None:
+            self.timings.record(self.stage, time.perf_counter() - started_at)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        started_at = time.perf_counter()
+        message = self._reply(messages)
+        time.sleep(self.latency + self.token_latency * len(message.content.split()))
+        self._record(started_at)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> ChatResult:
+        started_at = time.perf_counter()
+        message = self._reply(messages)
+        await asyncio.sleep(
+            self.latency + self.token_latency * len(message.content.split())
+        )
+        self._record(started_at)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message: AIMessage) -> list[ChatGenerationChunk]:
+        """Ответ по частям: вызов инструментов целиком, текст - по словам"""
+        if message.tool_calls:
+            return [
+                ChatGenerationChunk(
+                    message=AIMessageChunk(
+                        content="",
+                        tool_call_chunks=[
+                            {
+                                "name": tool_call["name"],
+                                "args": json.dumps(
+                                    tool_call["args"], ensure_ascii=False
+                                ),
+                                "id": tool_call["id"],
+                                "index": 0,
+                            }
+                            for tool_call in message.tool_calls
+                        ],
+                        usage_metadata=message.usage_metadata,
+                    )
+                )
+            ]
+
+        words = message.content.split()
+        return [
+            ChatGenerationChunk(
+                message=AIMessageChunk(
+                    content=word if i == 0 else f" {word}",
+                    usage_metadata=(
+                        message.usage_metadata if i == len(words) - 1 else None
+                    ),
+                )
+            )
+            for i, word in enumerate(words)
+        ]
+
+    def _stream(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> Iterator[ChatGenerationChunk]:
+        started_at = time.perf_counter()
+        message = self._reply(messages)
+        time.sleep(self.latency)
+        for i, chunk in enumerate(self._chunks(message)):
+            if i:
+                time.sleep(self.token_latency)
+            yield chunk
+        self._record(started_at)
+
+    async def _astream(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        started_at = time.perf_counter()
+        message = self._reply(messages)
+        await asyncio.sleep(self.latency)
+        for i, chunk in enumerate(self._chunks(message)):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield chunk
+        self._record(started_at)
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Детерминированные dense эмбеддинги вместо OpenAI: вектор из генератора
+    случайных чисел с seed из хэша текста. Задержка имитирует вызов API.
+    """
+
+    def __init__(self, size: int = 1536, latency: float = 0.05):
+        self.size = size
+        self.latency = latency
+
+    def _vector(self, text: str) -> list[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8])
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self.latency)
+        return self._vector(text)
+
+
+class FakeTranscriptions:
+    """Замена client.audio.transcriptions: текст выбирается по хэшу аудио"""
+
+    def __init__(self, transcripts: list[str], latency: float):
+        self.transcripts = transcripts
+        self.latency = latency
+
+    async def create(self, model: str, file: tuple) -> SimpleNamespace:
+        _, content, _ = file
+        await asyncio.sleep(self.latency)
+        index = zlib.crc32(content) % len(self.transcripts)
+        return SimpleNamespace(text=self.transcripts[index])
+
+
+class FakeOpenAIClient:
+    """Минимальная замена openai.AsyncOpenAI для TranscriptionService"""
+
+    def __init__(self, transcripts: list[str], latency: float = 0.5):
+        self.audio = SimpleNamespace(
+            transcriptions=FakeTranscriptions(transcripts, latency)
+        )
+
+    async def close(self) -> None:
+        pass
+
+
+class NullChatLogWriter:
+    """Запись логов диалогов без Postgres (режим --storage memory)"""
+
+    def start(self) -> None:
+        pass
+
+    async def log(self, *args, **kwargs) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,102 @@
+"""
+Время импорта app.main - проверка на регрессию холодного старта.
+
+Каждый замер идет в новом процессе Python, чтобы модули не брались из
+sys.modules. Импорт не должен создавать движок бд, загружать модели
+и обращаться к сети: все тяжелое создается в lifespan.
+
+    python -m benchmarks.import_time --runs 5 --max-seconds 5
+
+Код выхода 1, если медиана больше --max-seconds или импорт создал движок бд.
+С --top выводятся самые медленные модули по данным python -X importtime.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MODULE = "app.main"
+# Бюджет на медиану времени импорта, секунды
+MAX_SECONDS = 5.0
+
+MEASURE_CODE = f"""
+import json, time
+started_at = time.perf_counter()
+import {MODULE}
+seconds = time.perf_counter() - started_at
+from app.core.database import get_engine
+print(json.dumps({{
+    "seconds": seconds,
+    "engine_created": get_engine.cache_info().currsize > 0,
+}}))
+"""
+
+
+def measure_once() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE_CODE],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_modules(top: int) -> list[tuple[int, str]]:
+    """Модули с наибольшим собственным временем импорта, микросекунды"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        modules.append((int(self_us), name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=f"Measure `import {MODULE}` time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=MAX_SECONDS,
+        help="fail when the median import time exceeds this",
+    )
+    parser.add_argument(
+        "--top", type=int, default=0, help="print the N slowest modules"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    samples = [measure_once() for _ in range(args.runs)]
+    seconds = [sample["seconds"] for sample in samples]
+    median = statistics.median(seconds)
+    print(
+        f"import {MODULE}: median {median:.2f}s, "
+        f"min {min(seconds):.2f}s, max {max(seconds):.2f}s ({args.runs} runs)"
+    )
+
+    if args.top:
+        print("slowest modules (self time):")
+        for self_us, name in slowest_modules(args.top):
+            print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if any(sample["engine_created"] for sample in samples):
+        print("FAIL: database engine is created at import time")
+        failed = True
+    if median > args.max_seconds:
+        print(f"FAIL: median import time is above {args.max_seconds:.2f}s")
+        failed = True
+    sys.exit(1 if failed else 0)
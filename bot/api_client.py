@@ -0,0 +1,38 @@
+import os
+
+import httpx
+from dotenv import load_dotenv
+
+
+def create_api_client() -> httpx.AsyncClient:
+    """
+    Один клиент к FastAPI на всё время жизни бота: keep-alive соединения
+    переиспользуются между сообщениями вместо нового соединения на каждое.
+
+    Настройки читаются из окружения при создании клиента, а не при импорте модуля.
+
+    HTTP/2 не включен намеренно: API работает под uvicorn, который поддерживает
+    только HTTP/1.1 (а без TLS и h2c), так что http2=True и пакет h2 ничего не дадут.
+    Параллельные запросы идут по пулу keep-alive соединений.
+    """
+    load_dotenv()
+    env = os.environ
+
+    limits = httpx.Limits(
+        max_connections=int(env.get("API_MAX_CONNECTIONS", 50)),
+        max_keepalive_connections=int(env.get("API_MAX_KEEPALIVE_CONNECTIONS", 20)),
+    )
+    timeout = httpx.Timeout(
+        float(env.get("API_TIMEOUT", 60.0)),
+        connect=float(env.get("API_CONNECT_TIMEOUT", 5.0)),
+    )
+    return httpx.AsyncClient(
+        base_url=env["FASTAPI_URL"],
+        headers={"access_token": env.get("API_SECRET_KEY", "")},
+        timeout=timeout,
+        transport=httpx.AsyncHTTPTransport(
+            limits=limits,
+            # Повторяются только неудачные подключения, поэтому POST запросы не дублируются
+            retries=int(env.get("API_CONNECT_RETRIES", 2)),
+        ),
+    )
@@ -7,6 +7,7 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 
 from app.core.config import settings
+from bot.api_client import create_api_client
 from bot.handlers import routers_list
 
 
@@ -39,15 +40,22 @@ def get_storage():
 
 async def main():
     setup_logging()
+    if not settings.BOT_TOKEN:
+        raise RuntimeError("BOT_TOKEN is not set")
     storage = get_storage()
 
     bot = Bot(token=settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-    dp = Dispatcher(storage=storage)
+    api_client = create_api_client()
+    # api_client передается в хэндлеры как аргумент с тем же именем
+    dp = Dispatcher(storage=storage, api_client=api_client)
 
     dp.include_routers(*routers_list)
 
     await on_startup(bot)
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await api_client.aclose()
 
 
 if __name__ == "__main__":
@@ -1,21 +1,17 @@
 import io
 import logging
-import os
 
 import httpx
-from chatgpt_md_converter import telegram_format
-from dotenv import load_dotenv
 from aiogram import Router, F, types, Bot
 
-load_dotenv()
+from bot.streaming import ERROR_TEXT, stream_to_message
 
 audio_router = Router()
-FASTAPI_ENDPOINT = os.environ.get("FASTAPI_URL") + "chat/audio"
-API_SECRET_KEY = os.environ.get("API_SECRET_KEY")
+FASTAPI_ENDPOINT = "chat/audio/stream"
 
 
 @audio_router.message(F.voice)
-async def invoke_audio(message: types.Message, bot: Bot):
+async def invoke_audio(message: types.Message, bot: Bot, api_client: httpx.AsyncClient):
     waiting_message = await message.reply("Секунду...")
 
     audio = message.voice.file_id
@@ -28,19 +24,19 @@ async def invoke_audio(message: types.Message, bot: Bot):
     file_buffer.seek(0)
 
     files = {"audio": (f"{title}.ogg", file_buffer, "audio/ogg")}
-    data = {"user_id": str(message.from_user.id)}
-
-    async with httpx.AsyncClient() as client:
+    # file_unique_id позволяет серверу не транскрибировать повторно пересланные голосовые
+    # message_id отсекает повторную отправку того же сообщения
+    data = {
+        "user_id": str(message.from_user.id),
+        "audio_id": title,
+        "message_id": str(message.message_id),
+    }
+
+    try:
         logging.info("Sending AUDIO request to server...")
-        headers = {"access_token": API_SECRET_KEY}
-        response = await client.post(
-            FASTAPI_ENDPOINT, files=files, data=data, timeout=60.0, headers=headers
+        await stream_to_message(
+            api_client, FASTAPI_ENDPOINT, waiting_message, data=data, files=files
         )
-        if response.status_code == 200:
-            server_resp = response.json()
-            await waiting_message.edit_text(
-                telegram_format(f"{server_resp.get('response')}")
-            )
-        else:
-            logging.error(f"Server response: {response.json()}")
-            await waiting_message.edit_text("❌ Произошла ошибка, попробуйте позже")
+    except httpx.HTTPError as e:
+        logging.error(f"Server Exception: {str(e)}")
+        await waiting_message.edit_text(ERROR_TEXT)
@@ -1,21 +1,17 @@
 import io
 import logging
-import os
 
 import httpx
 from aiogram import Router, F, types, Bot
-from chatgpt_md_converter import telegram_format
-from dotenv import load_dotenv
 
-load_dotenv()
+from bot.streaming import stream_to_message
 
 image_router = Router()
-FASTAPI_ENDPOINT = os.environ.get("FASTAPI_URL") + "chat/text"
-API_SECRET_KEY = os.environ.get("API_SECRET_KEY")
+FASTAPI_ENDPOINT = "chat/text/stream"
 
 
 @image_router.message(F.photo)
-async def invoke_image(message: types.Message, bot: Bot):
+async def invoke_image(message: types.Message, bot: Bot, api_client: httpx.AsyncClient):
     waiting_message = await message.reply("Секунду...")
 
     photo = message.photo[-1].file_id
@@ -30,25 +26,18 @@ async def invoke_image(message: types.Message, bot: Bot):
 
     caption = message.caption or ""
 
-    data = {"user_id": str(message.from_user.id), "question": caption}
-
-    async with httpx.AsyncClient() as client:
-        try:
-            logging.info("Sending PHOTO request to server...")
-            headers = {"access_token": API_SECRET_KEY}
-            response = await client.post(
-                FASTAPI_ENDPOINT, files=files, data=data, timeout=60.0, headers=headers
-            )
-
-            logging.info(f"Server response: {response.json()}")
-            if response.status_code == 200:
-                server_resp = response.json()
-                await waiting_message.edit_text(
-                    telegram_format(f"{server_resp.get('response')}")
-                )
-            else:
-                logging.error(f"Server error: {response.json()}")
-                await waiting_message.edit_text("❌ Произошла ошибка, попробуйте позже")
-        except Exception as e:
-            logging.error(f"Server Exception: {str(e)}")
-            await waiting_message.edit_text("Ошибка подключения, попробуйте позже")
+    # message_id отсекает повторную отправку того же сообщения
+    data = {
+        "user_id": str(message.from_user.id),
+        "question": caption,
+        "message_id": str(message.message_id),
+    }
+
+    try:
+        logging.info("Sending PHOTO request to server...")
+        await stream_to_message(
+            api_client, FASTAPI_ENDPOINT, waiting_message, data=data, files=files
+        )
+    except Exception as e:
+        logging.error(f"Server Exception: {str(e)}")
+        await waiting_message.edit_text("Ошибка подключения, попробуйте позже")
@@ -1,18 +1,15 @@
 import logging
-import os
 
 import httpx
 from aiogram import Router
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message
 from chatgpt_md_converter import telegram_format
-from dotenv import load_dotenv
 
-load_dotenv()
+from bot.streaming import ERROR_TEXT
 
 user_router = Router()
-FASTAPI_ENDPOINT = os.environ.get("FASTAPI_URL") + "chat/delete_history"
-API_SECRET_KEY = os.environ.get("API_SECRET_KEY")
+FASTAPI_ENDPOINT = "chat/delete_history"
 
 
 @user_router.message(CommandStart())
@@ -22,18 +19,20 @@ async def user_start(message: Message):
 
 
 @user_router.message(Command("clear_history"))
-async def clear_history(message: Message):
+async def clear_history(message: Message, api_client: httpx.AsyncClient):
     """Удаляем историю"""
-    async with httpx.AsyncClient() as client:
-        logging.info("Removing chat history...")
-        data = {"user_id": str(message.from_user.id)}
-        headers = {"access_token": API_SECRET_KEY}
-        response = await client.post(
-            FASTAPI_ENDPOINT, data=data, timeout=60.0, headers=headers
-        )
-        if response.status_code == 200:
-            logging.info("Successfully removed chat history.")
-            await message.answer("История очищена")
-        else:
-            logging.error(f"Server response: {response.json()}")
-            await message.answer("❌ Произошла ошибка, попробуйте позже")
+    logging.info("Removing chat history...")
+    data = {"user_id": str(message.from_user.id)}
+    try:
+        response = await api_client.post(FASTAPI_ENDPOINT, data=data)
+    except httpx.HTTPError as e:
+        logging.error(f"Server Exception: {str(e)}")
+        await message.answer(ERROR_TEXT)
+        return
+
+    if response.status_code == 200:
+        logging.info("Successfully removed chat history.")
+        await message.answer("История очищена")
+    else:
+        logging.error(f"Server response: {response.text}")
+        await message.answer(ERROR_TEXT)
@@ -0,0 +1,154 @@
+import json
+import logging
+import time
+from typing import Any, AsyncIterator
+
+import httpx
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+from chatgpt_md_converter import telegram_format
+
+# Telegram ограничивает частоту правок сообщения, поэтому правим не чаще раза в EDIT_INTERVAL
+EDIT_INTERVAL = 1.5  # секунды
+MIN_EDIT_CHARS = 20  # минимальный прирост текста между правками
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Длинный ответ делится на части с запасом: разметка HTML увеличивает длину текста
+ANSWER_PART_CHARS = 3500
+
+ERROR_TEXT = "❌ Произошла ошибка, попробуйте позже"
+
+
+async def iter_sse(response: httpx.Response) -> AsyncIterator[tuple[str, Any]]:
+    """Разбирает server-sent events из ответа сервера"""
+    event, data = "message", []
+    async for line in response.aiter_lines():
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line.removeprefix("event:").strip()
+        elif line.startswith("data:"):
+            data.append(line.removeprefix("data:").strip())
+
+
+async def _edit(message: Message, text: str, **kwargs) -> bool:
+    try:
+        await message.edit_text(text, **kwargs)
+        return True
+    except TelegramBadRequest as e:
+        # "message is not modified" и подобные ошибки не должны обрывать стрим
+        logging.warning(f"Failed to edit message: {e}")
+        return False
+
+
+async def _reply(message: Message, text: str, **kwargs) -> bool:
+    try:
+        await message.answer(text, **kwargs)
+        return True
+    except TelegramBadRequest as e:
+        logging.warning(f"Failed to send message: {e}")
+        return False
+
+
+def split_text(text: str, limit: int = ANSWER_PART_CHARS) -> list[str]:
+    """Делит текст на части не длиннее limit, по возможности по границам строк"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        parts.append(text)
+    return parts
+
+
+async def send_answer(waiting_message: Message, answer: str) -> None:
+    """
+    Финальный ответ с разметкой. Первая часть заменяет waiting_message,
+    остальные части длинного ответа отправляются следующими сообщениями.
+    Если Telegram не принял разметку, часть отправляется простым текстом
+    """
+    parts = split_text(answer)
+    if not parts:
+        await _edit(waiting_message, ERROR_TEXT)
+        return
+
+    for i, part in enumerate(parts):
+        send = _edit if i == 0 else _reply
+        formatted = telegram_format(part)
+        if len(formatted) <= TELEGRAM_MESSAGE_LIMIT and await send(
+            waiting_message, formatted
+        ):
+            continue
+        await send(waiting_message, part, parse_mode=None)
+
+
+async def stream_to_message(
+    client: httpx.AsyncClient,
+    url: str,
+    waiting_message: Message,
+    data: dict,
+    files: dict | None = None,
+) -> None:
+    """
+    Читает SSE стрим ответа агента и постепенно правит waiting_message.
+
+    Промежуточный текст отправляется без разметки (незакрытые теги ломают HTML),
+    финальный ответ - через telegram_format.
+    """
+    async with client.stream("POST", url, data=data, files=files) as response:
+        if response.status_code != 200:
+            await response.aread()
+            logging.error(f"Server response: {response.text}")
+            await _edit(waiting_message, ERROR_TEXT)
+            return
+
+        text = ""
+        shown_chars = 0
+        last_edit = 0.0
+
+        async for event, payload in iter_sse(response):
+            now = time.monotonic()
+
+            if event == "token":
+                text += payload["text"]
+                if (
+                    now - last_edit >= EDIT_INTERVAL
+                    and len(text) - shown_chars >= MIN_EDIT_CHARS
+                ):
+                    await _edit(
+                        waiting_message,
+                        text[:TELEGRAM_MESSAGE_LIMIT],
+                        parse_mode=None,
+                    )
+                    shown_chars, last_edit = len(text), now
+
+            elif event == "tool":
+                # Текст до вызова инструмента - промежуточный, начинаем заново
+                text, shown_chars = "", 0
+                if payload.get("status") and now - last_edit >= EDIT_INTERVAL:
+                    await _edit(waiting_message, payload["status"], parse_mode=None)
+                    last_edit = now
+
+            elif event == "done":
+                await send_answer(waiting_message, payload.get("response") or "")
+                return
+
+            elif event == "merged":
+                # Сообщение объединено со следующим, ответ придет на последнее
+                try:
+                    await waiting_message.delete()
+                except TelegramBadRequest as e:
+                    logging.warning(f"Failed to delete message: {e}")
+                return
+
+            elif event == "error":
+                logging.error(f"Server stream error: {payload.get('detail')}")
+                await _edit(waiting_message, ERROR_TEXT)
+                return
+
+    logging.error("Stream ended without a final answer")
+    await _edit(waiting_message, ERROR_TEXT)
@@ -1,20 +1,40 @@
+import argparse
+import asyncio
+import hashlib
 import logging
-from uuid import uuid4
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
 
 from langchain_community.document_loaders import UnstructuredMarkdownLoader
+from langchain_core.documents import Document
 from langchain_openai import OpenAIEmbeddings
-from langchain_qdrant import FastEmbedSparse, QdrantVectorStore, RetrievalMode
+from langchain_qdrant import FastEmbedSparse, QdrantVectorStore
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from openai import APIConnectionError, APITimeoutError, RateLimitError
 from qdrant_client import QdrantClient
+from qdrant_client.http.exceptions import (
+    ResponseHandlingException,
+    UnexpectedResponse,
+)
 from qdrant_client.http.models import (
-    VectorParams,
-    Distance,
-    SparseVectorParams,
-    SparseIndexParams,
-    Modifier,
+    PayloadSchemaType,
+    PointStruct,
+    SparseVector,
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
 )
 
 from app.core.config import settings
+from app.core.qdrant_profiles import (
+    COLLECTION_VERSION_KEY,
+    QdrantProfile,
+    get_qdrant_profile,
+)
 
 
 logging.basicConfig(level=logging.INFO)
@@ -24,57 +44,422 @@ VECTOR_NAME = "dense"
 SPARSE_VECTOR_NAME = "sparce"
 CHUNK_SIZE = 1024
 CHUNK_OVERLAP = 200
+LESSONS_PATH = "./data_pipeline/data/lessons_clean.md"
+COPY_BATCH_SIZE = 256
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+SPARSE_MODEL = "Qdrant/bm25"
+EMBED_BATCH_SIZE = 64  # чанков в одном запросе к OpenAI и в одном upsert
+INGEST_CONCURRENCY = 4  # пачек в работе одновременно
+SPARSE_WORKERS = min(4, os.cpu_count() or 1)
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 1.0  # секунды, удваивается с каждой попыткой
+RETRY_MAX_DELAY = 60.0
+RETRYABLE_ERRORS = (
+    RateLimitError,
+    APITimeoutError,
+    APIConnectionError,
+    ResponseHandlingException,  # сетевые ошибки клиента Qdrant
+    ConnectionError,  # в том числе сброс соединения
+)
+
+# Ключ в metadata коллекции: для какого алиаса ее собрал этот скрипт. Чистка
+# удаляет только такие коллекции, а не все с тем же префиксом имени
+COLLECTION_ALIAS_KEY = "alias"
+
+# Пространство имен для детерминированных UUID чанков
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c2a0e-3b8d-4e5f-9a7c-1d2e3f4a5b6c")
 
 client = QdrantClient(host=settings.QDRANT_HOST_OFFLINE, port=settings.QDRANT_PORT)
 
 
-def create_qdrant_collection():
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    sparse_embeddings = FastEmbedSparse(model_name="Qdrant/bm25")
+def get_data_version(profile_name: str) -> str:
+    """Версия данных: хэш файла уроков, параметров разбиения на чанки и профиля коллекции"""
+    with open(LESSONS_PATH, "rb") as f:
+        digest = hashlib.sha256(f.read())
+    digest.update(f"{CHUNK_SIZE}:{CHUNK_OVERLAP}:{profile_name}".encode())
+    return digest.hexdigest()
+
+
+def chunk_id(doc: Document) -> str:
+    """ID точки - хэш содержимого чанка, поэтому одинаковый чанк всегда получает тот же ID"""
+    digest = hashlib.sha256(
+        f"{doc.metadata.get('source', '')}\n{doc.page_content}".encode("utf-8")
+    ).hexdigest()
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, digest))
+
+
+def load_chunks() -> dict[str, Document]:
+    """Загружает уроки и режет на чанки. Ключ - детерминированный ID чанка"""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+    )
+
+    logger.info("Loading and splitting lesson data")
+    docs = UnstructuredMarkdownLoader(LESSONS_PATH).load()
+    splits = text_splitter.split_documents(docs)
+
+    # Повторяющиеся чанки схлопываются в одну точку
+    return {chunk_id(split): split for split in splits}
 
-    logger.info("Creating data collection")
 
-    if client.collection_exists(settings.QDRANT_COLLECTION_NAME):
-        client.delete_collection(settings.QDRANT_COLLECTION_NAME)
+def create_qdrant_collection(
+    collection_name: str, profile: QdrantProfile, alias_name: str
+):
+    logger.info(f"Creating data collection {collection_name}")
 
     client.create_collection(
-        collection_name=settings.QDRANT_COLLECTION_NAME,
-        vectors_config={VECTOR_NAME: VectorParams(size=1536, distance=Distance.COSINE)},
+        collection_name=collection_name,
+        metadata={COLLECTION_ALIAS_KEY: alias_name},
+        vectors_config={VECTOR_NAME: profile.vector_params(size=1536)},
         sparse_vectors_config={
-            SPARSE_VECTOR_NAME: SparseVectorParams(
-                modifier=Modifier.IDF, index=SparseIndexParams(on_disk=False)
-            )
+            SPARSE_VECTOR_NAME: profile.sparse_vector_params(),
         },
+        on_disk_payload=profile.on_disk_payload,
     )
 
-    logger.info("Creating vector store")
-    vector_store = QdrantVectorStore(
-        client=client,
-        collection_name=settings.QDRANT_COLLECTION_NAME,
-        embedding=embeddings,
-        sparse_embedding=sparse_embeddings,
-        retrieval_mode=RetrievalMode.HYBRID,
-        vector_name=VECTOR_NAME,
-        sparse_vector_name=SPARSE_VECTOR_NAME,
+    for field_name, field_schema in profile.payload_indexes.items():
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=PayloadSchemaType(field_schema),
+        )
+
+
+def get_embeddings() -> OpenAIEmbeddings:
+    return OpenAIEmbeddings(model=EMBEDDING_MODEL, chunk_size=EMBED_BATCH_SIZE)
+
+
+_sparse_model: FastEmbedSparse | None = None
+
+
+def _init_sparse_worker():
+    global _sparse_model
+    _sparse_model = FastEmbedSparse(model_name=SPARSE_MODEL)
+
+
+def _sparse_encode(texts: list[str]) -> list[tuple[list[int], list[float]]]:
+    """BM25 в отдельном процессе: FastEmbed считает на CPU и держит GIL"""
+    return [
+        (vector.indices, vector.values)
+        for vector in _sparse_model.embed_documents(texts)
+    ]
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limit, сетевые ошибки и временные ответы Qdrant (429, 5xx)"""
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code is not None and (
+            error.status_code == 429 or error.status_code >= 500
+        )
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def retry_delay(attempt: int) -> float:
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt)
+    return delay * (0.5 + random.random() / 2)
+
+
+async def with_retries(func, *args, what: str):
+    """Повторяет вызов с экспоненциальной задержкой при rate limit и сетевых ошибках"""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return await func(*args)
+        except Exception as e:
+            if not is_retryable(e) or attempt == MAX_RETRIES - 1:
+                raise
+            delay = retry_delay(attempt)
+            logger.warning(f"{what} failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def call_with_retries(func, *args, what: str, **kwargs):
+    """Синхронный with_retries для вызовов клиента Qdrant вне event loop"""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e) or attempt == MAX_RETRIES - 1:
+                raise
+            delay = retry_delay(attempt)
+            logger.warning(f"{what} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.started_at = time.monotonic()
+
+    def advance(self, count: int):
+        self.done += count
+        elapsed = time.monotonic() - self.started_at
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else 0.0
+        logger.info(
+            f"Ingested {self.done}/{self.total} chunks "
+            f"({rate:.1f} chunks/s, ETA {eta:.0f}s)"
+        )
+
+
+async def embed_and_upsert(
+    collection_name: str, chunks: list[tuple[str, Document]]
+) -> None:
+    """
+    Потоковая загрузка чанков пачками по EMBED_BATCH_SIZE.
+
+    Для каждой пачки dense эмбеддинги (OpenAI) и BM25 (пул процессов) считаются
+    параллельно, затем пачка сразу пишется в Qdrant. Одновременно в работе не
+    больше INGEST_CONCURRENCY пачек, так что память и нагрузка на API ограничены.
+    Точки пишутся с детерминированными ID, поэтому загруженные пачки
+    переживают падение скрипта и при перезапуске пропускаются.
+    """
+    embeddings = get_embeddings()
+    semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+    progress = Progress(len(chunks))
+    loop = asyncio.get_running_loop()
+
+    with ProcessPoolExecutor(
+        max_workers=SPARSE_WORKERS, initializer=_init_sparse_worker
+    ) as sparse_pool:
+
+        async def process_batch(batch: list[tuple[str, Document]]):
+            texts = [doc.page_content for _, doc in batch]
+            async with semaphore:
+                dense, sparse = await asyncio.gather(
+                    with_retries(
+                        embeddings.aembed_documents, texts, what="Dense embedding"
+                    ),
+                    loop.run_in_executor(sparse_pool, _sparse_encode, texts),
+                )
+                points = [
+                    PointStruct(
+                        id=point_id,
+                        vector={
+                            VECTOR_NAME: dense_vector,
+                            SPARSE_VECTOR_NAME: SparseVector(
+                                indices=indices, values=values
+                            ),
+                        },
+                        payload={
+                            QdrantVectorStore.CONTENT_KEY: doc.page_content,
+                            QdrantVectorStore.METADATA_KEY: doc.metadata,
+                        },
+                    )
+                    for (point_id, doc), dense_vector, (indices, values) in zip(
+                        batch, dense, sparse
+                    )
+                ]
+                await with_retries(
+                    asyncio.to_thread,
+                    client.upsert,
+                    collection_name,
+                    points,
+                    what="Qdrant upsert",
+                )
+            progress.advance(len(batch))
+
+        await asyncio.gather(
+            *(
+                process_batch(chunks[i : i + EMBED_BATCH_SIZE])
+                for i in range(0, len(chunks), EMBED_BATCH_SIZE)
+            )
+        )
+
+
+def resolve_live_collection(alias_name: str) -> str | None:
+    """Коллекция, на которую сейчас смотрит сервер: цель алиаса или коллекция с таким именем"""
+    for alias in client.get_aliases().aliases:
+        if alias.alias_name == alias_name:
+            return alias.collection_name
+
+    if client.collection_exists(alias_name):
+        return alias_name
+    return None
+
+
+def get_collection_metadata(collection_name: str) -> dict:
+    return client.get_collection(collection_name).config.metadata or {}
+
+
+def get_collection_version(collection_name: str) -> str | None:
+    return get_collection_metadata(collection_name).get(COLLECTION_VERSION_KEY)
+
+
+def load_manifest(collection_name: str) -> set[str]:
+    """Манифест уже посчитанных эмбеддингов: ID точек живой коллекции"""
+    manifest = set()
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=COPY_BATCH_SIZE,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        manifest.update(str(point.id) for point in points)
+        if offset is None:
+            return manifest
+
+
+def copy_points(source: str, target: str, ids: list[str]):
+    """Переносит готовые векторы неизмененных чанков без повторного эмбеддинга"""
+    for i in range(0, len(ids), COPY_BATCH_SIZE):
+        records = call_with_retries(
+            client.retrieve,
+            what="Qdrant retrieve",
+            collection_name=source,
+            ids=ids[i : i + COPY_BATCH_SIZE],
+            with_payload=True,
+            with_vectors=True,
+        )
+        call_with_retries(
+            client.upsert,
+            what="Qdrant upsert",
+            collection_name=target,
+            points=[
+                PointStruct(id=record.id, vector=record.vector, payload=record.payload)
+                for record in records
+            ],
+        )
+
+
+def swap_alias(alias_name: str, new_collection: str, old_collection: str | None):
+    """Атомарно переключает алиас на новую коллекцию и удаляет старую"""
+    if old_collection == alias_name:
+        # Первый запуск после перехода на алиасы: имя занято обычной коллекцией.
+        # Пока коллекция удаляется и создается алиас, поиск по этому имени недоступен
+        logger.warning(f"Replacing collection {alias_name} with an alias")
+        client.delete_collection(old_collection)
+        old_collection = None
+
+    operations = []
+    if old_collection is not None:
+        operations.append(
+            DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias_name))
+        )
+    operations.append(
+        CreateAliasOperation(
+            create_alias=CreateAlias(
+                collection_name=new_collection, alias_name=alias_name
+            )
+        )
     )
+    client.update_collection_aliases(change_aliases_operations=operations)
+    logger.info(f"Alias {alias_name} now points to {new_collection}")
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
+    if old_collection is not None and old_collection != new_collection:
+        client.delete_collection(old_collection)
+
+    # Незаконченные коллекции прерванных запусков с другой версией данных.
+    # Другие коллекции с тем же префиксом (чужие алиасы, ручные бэкапы) не трогаем
+    for collection in client.get_collections().collections:
+        if not collection.name.startswith(f"{alias_name}_") or collection.name in (
+            new_collection,
+            old_collection,
+        ):
+            continue
+        metadata = get_collection_metadata(collection.name)
+        if metadata.get(COLLECTION_ALIAS_KEY) == alias_name:
+            logger.info(f"Deleting stale collection {collection.name}")
+            client.delete_collection(collection.name)
+
+
+def ingest_lessons(
+    full: bool = False, profile_name: str = settings.QDRANT_PROFILE
+):
+    """
+    Загружает уроки в Qdrant.
+
+    Данные собираются в новой коллекции <alias>_<version>, после чего алиас
+    QDRANT_COLLECTION_NAME атомарно переключается на нее (blue/green), поэтому
+    сервер никогда не видит наполовину загруженный индекс.
+    В инкрементальном режиме эмбеддинги считаются только для новых и измененных
+    чанков, остальные копируются из живой коллекции, удаленные чанки не переносятся.
+    """
+    alias_name = settings.QDRANT_COLLECTION_NAME
+    profile = get_qdrant_profile(profile_name)
+    version = get_data_version(profile_name)
+    live_collection = resolve_live_collection(alias_name)
+
+    if (
+        not full
+        and live_collection is not None
+        and get_collection_version(live_collection) == version
+    ):
+        logger.info(f"Collection {live_collection} is up to date")
+        return
+
+    new_collection = f"{alias_name}_{version[:12]}"
+    if new_collection == live_collection:
+        # --full при неизменных данных: живую коллекцию не трогаем до переключения
+        new_collection = f"{new_collection}_rebuild"
+
+    # Незаконченная коллекция с той же версией - чекпоинт прерванного запуска:
+    # уже загруженные в нее точки повторно не считаются
+    loaded = set()
+    if client.collection_exists(new_collection):
+        if full:
+            client.delete_collection(new_collection)
+        else:
+            loaded = load_manifest(new_collection)
+            logger.info(
+                f"Resuming {new_collection}: {len(loaded)} points already loaded"
+            )
+    if not client.collection_exists(new_collection):
+        create_qdrant_collection(new_collection, profile, alias_name)
+
+    chunks = load_chunks()
+    manifest = (
+        load_manifest(live_collection) if live_collection and not full else set()
+    )
+    pending = [point_id for point_id in chunks if point_id not in loaded]
+    unchanged = [point_id for point_id in pending if point_id in manifest]
+    new = [point_id for point_id in pending if point_id not in manifest]
+    logger.info(
+        f"{len(chunks)} chunks: {len(loaded)} already loaded, "
+        f"{len(unchanged)} unchanged, {len(new)} to embed, "
+        f"{len(manifest - chunks.keys())} removed"
     )
 
-    logger.info("Loading and splitting lesson data")
-    docs = UnstructuredMarkdownLoader("./data_pipeline/data/lessons_clean.md").load()
-    splits = text_splitter.split_documents(docs)
+    if unchanged:
+        logger.info(f"Copying {len(unchanged)} points from {live_collection}")
+        copy_points(live_collection, new_collection, unchanged)
+
+    if new:
+        logger.info(f"Embedding and upserting {len(new)} points")
+        asyncio.run(
+            embed_and_upsert(
+                new_collection, [(point_id, chunks[point_id]) for point_id in new]
+            )
+        )
 
-    logger.info("Upserting data points")
-    uuids = [str(uuid4()) for _ in range(len(splits))]
-    vector_store.add_documents(splits, uuids=uuids)
+    # Версию пишем после загрузки: по ней сервер понимает, что уроки обновились,
+    # и сбрасывает кэш ответов
+    client.update_collection(
+        collection_name=new_collection,
+        metadata={COLLECTION_VERSION_KEY: version, COLLECTION_ALIAS_KEY: alias_name},
+    )
+
+    swap_alias(alias_name, new_collection, live_collection)
 
 
 if __name__ == "__main__":
-    if not client.collection_exists(settings.QDRANT_COLLECTION_NAME):
-        logging.warning(
-            f"Collection {settings.QDRANT_COLLECTION_NAME} does not exist. Creating..."
-        )
-        create_qdrant_collection()
+    parser = argparse.ArgumentParser(description="Загрузка уроков в Qdrant")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Пересчитать эмбеддинги всех чанков, а не только новых и измененных",
+    )
+    parser.add_argument(
+        "--profile",
+        default=settings.QDRANT_PROFILE,
+        help="Профиль коллекции (квантование, HNSW, хранение на диске), "
+        "должен совпадать с QDRANT_PROFILE сервера",
+    )
+    args = parser.parse_args()
+
+    ingest_lessons(full=args.full, profile_name=args.profile)
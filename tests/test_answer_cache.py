@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.answer_cache import AnswerCache
+
+
+class KeywordEmbeddings:
+    """Вектор - по одной оси на слово из словаря, чтобы сходство было предсказуемым"""
+
+    words = ["падеж", "частица", "окончание", "глагол"]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return [float(word in text) for word in self.words]
+
+
+class FakeQdrant:
+    version = "1"
+
+    async def get_collection(self, collection_name):
+        return SimpleNamespace(
+            config=SimpleNamespace(metadata={"version": self.version})
+        )
+
+
+@pytest.fixture
+async def answer_cache() -> AnswerCache:
+    cache = AnswerCache(
+        embeddings=KeywordEmbeddings(),
+        qdrant_client=FakeQdrant(),
+        collection_name="lessons",
+        max_size=2,
+        ttl=60,
+        threshold=0.95,
+        version_check_interval=60,
+    )
+    # Первая проверка версии коллекции сбрасывает кэш, делаем ее до заполнения
+    await cache._check_version()
+    return cache
+
+
+async def test_lookup_returns_similar_answer(answer_cache):
+    await answer_cache.store("что такое падеж", "ответ про падеж", "1")
+
+    assert await answer_cache.lookup("падеж это что") == "ответ про падеж"
+    assert await answer_cache.lookup("что такое частица") is None
+    assert answer_cache.stats()["hits"] == 1
+
+
+async def test_hit_protects_entry_from_eviction(answer_cache):
+    await answer_cache.store("падеж", "ответ про падеж", "1")
+    await answer_cache.store("частица", "ответ про частицу", "1")
+    # Попадание делает "падеж" самым свежим, вытесняется "частица"
+    assert await answer_cache.lookup("падеж") == "ответ про падеж"
+
+    await answer_cache.store("окончание", "ответ про окончание", "1")
+
+    assert await answer_cache.lookup("падеж") == "ответ про падеж"
+    assert await answer_cache.lookup("частица") is None
+    assert await answer_cache.lookup("окончание") == "ответ про окончание"
+
+
+async def test_answer_from_old_collection_is_not_stored(answer_cache):
+    version = answer_cache.version
+    # Уроки загрузили заново, пока шел ход агента
+    answer_cache.qdrant_client.version = "2"
+    answer_cache._version_checked_at = 0.0
+
+    await answer_cache.store("падеж", "ответ по старым урокам", version)
+
+    assert await answer_cache.lookup("падеж") is None
+    assert answer_cache.stats()["size"] == 0
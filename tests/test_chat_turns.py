@@ -0,0 +1,192 @@
+import asyncio
+
+import pytest
+
+from app.models.schemas import UserRequestType
+from app.services.chat_turns import ChatTurnController, TurnMessage
+
+
+def make_message(content: str, message_id: str | None = None) -> TurnMessage:
+    return TurnMessage(
+        content=content,
+        query=content,
+        request_type=UserRequestType.text,
+        message_id=message_id,
+    )
+
+
+class FakeRunner:
+    """Запоминает ходы агента и отвечает склеенными сообщениями"""
+
+    def __init__(self, delay: float = 0.01, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.turns: list[list[str]] = []
+
+    async def __call__(self, messages):
+        contents = [message.content for message in messages]
+        self.turns.append(contents)
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("model is down")
+        yield "token", {"text": contents[0]}
+        yield "done", {"response": " + ".join(contents)}
+
+
+async def collect(events) -> list[tuple[str, dict]]:
+    return [event async for event in events]
+
+
+@pytest.fixture
+async def make_controller():
+    controllers = []
+
+    def make(policy="queue", merge_window=0.05, merge_max_messages=10):
+        controller = ChatTurnController(policy, merge_window, merge_max_messages)
+        controllers.append(controller)
+        return controller
+
+    yield make
+    for controller in controllers:
+        await controller.close()
+
+
+async def test_queue_runs_turns_one_by_one(make_controller):
+    controller = make_controller("queue")
+    runner = FakeRunner()
+
+    # Одинаковый текст без message_id - разные сообщения, не повтор
+    streams = [
+        controller.submit("user", make_message(text), runner)
+        for text in ["a", "b", "a"]
+    ]
+    results = await asyncio.gather(*(collect(stream) for stream in streams))
+
+    assert runner.turns == [["a"], ["b"], ["a"]]
+    assert [events[-1] for events in results] == [
+        ("done", {"response": "a"}),
+        ("done", {"response": "b"}),
+        ("done", {"response": "a"}),
+    ]
+
+
+async def test_merge_sends_messages_as_one_turn(make_controller):
+    controller = make_controller("merge")
+    runner = FakeRunner()
+
+    streams = [
+        controller.submit("user", make_message(text), runner)
+        for text in ["a", "b", "c"]
+    ]
+    results = await asyncio.gather(*(collect(stream) for stream in streams))
+
+    assert runner.turns == [["a", "b", "c"]]
+    # Ответ получает последнее сообщение, остальные - merged
+    assert results[0][0] == ("merged", {"messages": 3})
+    assert results[1][0] == ("merged", {"messages": 3})
+    assert results[2] == [
+        ("token", {"text": "a"}),
+        ("done", {"response": "a + b + c"}),
+    ]
+
+
+async def test_merge_respects_max_messages(make_controller):
+    controller = make_controller("merge", merge_max_messages=2)
+    runner = FakeRunner()
+
+    streams = [
+        controller.submit("user", make_message(text), runner)
+        for text in ["a", "b", "c"]
+    ]
+    await asyncio.gather(*(collect(stream) for stream in streams))
+
+    assert runner.turns == [["a", "b"], ["c"]]
+
+
+async def test_retry_with_same_message_id_follows_running_turn(make_controller):
+    controller = make_controller("queue")
+    runner = FakeRunner()
+
+    first = controller.submit("user", make_message("a", "1"), runner)
+    other = controller.submit("user", make_message("b", "2"), runner)
+    retry = controller.submit("user", make_message("a", "1"), runner)
+    results = await asyncio.gather(collect(first), collect(other), collect(retry))
+
+    assert runner.turns == [["a"], ["b"]]
+    assert results[2] == results[0]
+
+
+async def test_message_id_is_scoped_to_thread(make_controller):
+    controller = make_controller("queue")
+    runner = FakeRunner()
+
+    streams = [
+        controller.submit("alice", make_message("a", "1"), runner),
+        controller.submit("bob", make_message("a", "1"), runner),
+    ]
+    await asyncio.gather(*(collect(stream) for stream in streams))
+
+    assert runner.turns == [["a"], ["a"]]
+
+
+async def test_finished_turn_is_not_reused(make_controller):
+    controller = make_controller("queue")
+    runner = FakeRunner()
+
+    await collect(controller.submit("user", make_message("a", "1"), runner))
+    await collect(controller.submit("user", make_message("a", "1"), runner))
+
+    assert runner.turns == [["a"], ["a"]]
+
+
+async def test_runner_error_is_published_and_next_turn_runs(make_controller):
+    controller = make_controller("queue")
+    failing = FakeRunner(fail=True)
+    runner = FakeRunner()
+
+    first = controller.submit("user", make_message("a"), failing)
+    second = controller.submit("user", make_message("b"), runner)
+    results = await asyncio.gather(collect(first), collect(second))
+
+    assert results[0] == [("error", {"detail": "model is down"})]
+    assert results[1][-1] == ("done", {"response": "b"})
+
+
+async def test_close_cancels_pending_turns(make_controller):
+    controller = make_controller("queue")
+    runner = FakeRunner(delay=10)
+
+    stream = controller.submit("user", make_message("a"), runner)
+    await asyncio.sleep(0)
+    await controller.close()
+
+    assert await collect(stream) == [("error", {"detail": "Server is shutting down"})]
+
+
+async def test_exclusive_action_waits_for_pending_turns(make_controller):
+    controller = make_controller("merge")
+    runner = FakeRunner()
+    log = []
+
+    async def delete():
+        log.append(("delete", list(runner.turns)))
+
+    # Окно merge открыто: очистка идет после хода и не принимает новые сообщения
+    first = controller.submit("user", make_message("a"), runner)
+    delete_task = asyncio.create_task(controller.run_exclusive("user", delete))
+    await asyncio.sleep(0)
+    second = controller.submit("user", make_message("b"), runner)
+    await asyncio.gather(collect(first), collect(second), delete_task)
+
+    assert log == [("delete", [["a"]])]
+    assert runner.turns == [["a"], ["b"]]
+
+
+async def test_exclusive_action_error_is_raised(make_controller):
+    controller = make_controller("queue")
+
+    async def delete():
+        raise RuntimeError("db is down")
+
+    with pytest.raises(RuntimeError, match="db is down"):
+        await controller.run_exclusive("user", delete)
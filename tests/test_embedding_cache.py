@@ -0,0 +1,102 @@
+from app.models.embedding_cache import EmbeddingCacheEntry
+from app.services import cache as cache_module
+from app.services.cache import LRUCache
+from app.services.embedding_cache import PersistentCacheStore, QueryCache, TieredCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class MemoryStore(PersistentCacheStore):
+    """Постоянный уровень в памяти вместо Postgres"""
+
+    def __init__(self):
+        super().__init__(EmbeddingCacheEntry, hash_keys=True)
+        self.rows = {}
+
+    async def get(self, key):
+        return self.rows.get(self._key(key))
+
+    async def set(self, key, value):
+        self.rows.setdefault(self._key(key), value)
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" становится самым свежим
+
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+
+def test_lru_expires_entries_after_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    cache = LRUCache(max_size=10, ttl=60)
+    cache.set("a", 1)
+
+    clock.now += 59
+    assert cache.get("a") == 1
+
+    clock.now += 2
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_stats_count_hits_and_misses():
+    cache = LRUCache(max_size=10)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+
+    stats = cache.stats()
+
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+
+async def test_tiered_cache_falls_back_to_store():
+    store = MemoryStore()
+    cache = TieredCache(max_size=1, store=store)
+    await cache.aset("a", [1.0])
+    await cache.aset("b", [2.0])  # "a" вытеснена из памяти, но осталась в store
+
+    assert await cache.aget("a") == [1.0]
+    assert cache.memory.get("a") == [1.0]
+
+    stats = cache.stats()
+    assert stats["db_hits"] == 1
+    assert stats["hits"] == 2
+    assert stats["misses"] == 0
+
+
+async def test_tiered_cache_without_store_misses():
+    cache = TieredCache(max_size=1)
+    await cache.aset("a", 1)
+    await cache.aset("b", 2)
+
+    assert await cache.aget("a") is None
+    assert cache.stats()["db_hits"] == 0
+
+
+def test_query_cache_key_normalizes_text():
+    cache = QueryCache("dense", max_size=10)
+    assert cache.key("  Привет   МИР ") == cache.key("привет мир")
+    assert cache.key("привет").startswith("dense:")
+
+
+async def test_store_without_ttl_does_not_prune():
+    # Без TTL prune не обращается к бд
+    assert await PersistentCacheStore(EmbeddingCacheEntry).prune(100) == 0
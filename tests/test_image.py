@@ -0,0 +1,30 @@
+import io
+
+from PIL import ExifTags, Image
+
+from app.services.agent.image import prepare_image
+
+
+def make_jpeg(size: tuple[int, int], orientation: int | None = None) -> bytes:
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[ExifTags.Base.Orientation] = orientation
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "red").save(buffer, format="JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def test_small_jpeg_is_sent_as_is():
+    data = make_jpeg((40, 20))
+
+    assert prepare_image(data).data == data
+
+
+def test_rotated_jpeg_is_transposed():
+    # Orientation 6 - телефон держали вертикально, пиксели лежат горизонтально
+    data = make_jpeg((40, 20), orientation=6)
+
+    prepared = prepare_image(data)
+
+    assert prepared.data != data
+    assert Image.open(io.BytesIO(prepared.data)).size == (20, 40)
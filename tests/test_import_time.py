@@ -0,0 +1,17 @@
+import statistics
+from pathlib import Path
+
+from benchmarks.import_time import MAX_SECONDS, measure_once
+
+RUNS = 3
+
+
+def test_import_app_main_is_fast_and_lazy(monkeypatch):
+    # Замеры в новых процессах; app должен импортироваться из корня репозитория
+    monkeypatch.chdir(Path(__file__).resolve().parents[1])
+    samples = [measure_once() for _ in range(RUNS)]
+
+    # Движок бд создается в lifespan, а не при импорте
+    assert not any(sample["engine_created"] for sample in samples)
+    median = statistics.median(sample["seconds"] for sample in samples)
+    assert median < MAX_SECONDS, f"import app.main took {median:.2f}s"
@@ -0,0 +1,38 @@
+import pytest
+
+from app.services.agent.tools import messages
+
+
+class FakeEncoding:
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+@pytest.fixture(autouse=True)
+def reset_encoding(monkeypatch):
+    monkeypatch.setattr(messages, "_encoding", None)
+    monkeypatch.setattr(messages, "_encoding_failed_at", None)
+
+
+def test_encoding_load_is_retried_after_failure(monkeypatch):
+    now = 1000.0
+    calls = []
+
+    def get_encoding(name):
+        calls.append(name)
+        if len(calls) == 1:
+            raise OSError("network is unreachable")
+        return FakeEncoding()
+
+    monkeypatch.setattr(messages.time, "monotonic", lambda: now)
+    monkeypatch.setattr(messages.tiktoken, "get_encoding", get_encoding)
+
+    # Пока словаря нет, токены оцениваются по длине текста
+    assert messages.count_tokens("a b c") == len("a b c") // 3 + 1
+    assert messages.count_tokens("a b c") == len("a b c") // 3 + 1
+    assert len(calls) == 1
+
+    now += messages.ENCODING_RETRY_INTERVAL + 1
+    assert messages.count_tokens("a b c") == 3
+    assert messages.count_tokens("a b c d") == 4
+    assert len(calls) == 2
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.documents import Document
+
+from app.services.agent import rerank as rerank_module
+from app.services.agent.rerank import Reranker
+
+
+class SlowCrossEncoder:
+    """Считает пачку кандидатов за batch_latency секунд и запоминает работу"""
+
+    batch_latency = 0.05
+
+    def __init__(self, model_name, threads=None):
+        self.scored = 0
+
+    def rerank(self, query, texts, batch_size):
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start : start + batch_size]
+            time.sleep(self.batch_latency)
+            self.scored += len(batch)
+            for text in batch:
+                yield float(len(text))
+
+
+@pytest.fixture
+def reranker(monkeypatch):
+    monkeypatch.setattr(rerank_module, "TextCrossEncoder", SlowCrossEncoder)
+    reranker = Reranker("fake", batch_size=2, timeout=0.12)
+    yield reranker
+    reranker.close()
+
+
+def make_docs(count: int) -> list[Document]:
+    return [Document(page_content="x" * (i + 1)) for i in range(count)]
+
+
+async def test_rerank_orders_by_score(reranker):
+    docs = make_docs(3)
+
+    ranked = await reranker.rerank("query", docs, top_n=2)
+
+    assert [doc.page_content for doc in ranked] == ["xxx", "xx"]
+
+
+async def test_timed_out_jobs_do_not_pile_up(reranker):
+    # 10 кандидатов - 5 пачек по 0.05с, в таймаут 0.12с не укладывается ни один
+    docs = make_docs(10)
+
+    results = await asyncio.gather(
+        *(reranker.rerank("query", docs, top_n=3) for _ in range(8))
+    )
+
+    assert all(result == docs[:3] for result in results)
+    assert reranker.timeouts == 8
+    # Поток бросает просроченные задачи: очередь пуста, а работа модели
+    # обрывается на первой пачке после дедлайна
+    await asyncio.sleep(0.2)
+    assert reranker._executor._work_queue.qsize() == 0
+    assert reranker.model.scored < len(docs)
+    assert reranker.skipped >= 1
+
+    # Следующий запрос, который укладывается в таймаут, снова переранжируется
+    ranked = await reranker.rerank("query", make_docs(2), top_n=2)
+    assert [doc.page_content for doc in ranked] == ["xx", "x"]
+
+
+async def test_warmup_measures_candidates(reranker, caplog):
+    await reranker.warmup("query", candidates=6)
+
+    # 3 пачки по 0.05с дольше таймаута 0.12с
+    assert reranker.warmup_seconds > reranker.timeout
+    assert "above RERANK_TIMEOUT" in caplog.text
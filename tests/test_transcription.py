@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+from app.services.agent.audio import TranscriptionService
+from app.services.transcript_cache import TranscriptCache
+
+
+class FakeUpload:
+    filename = "voice.ogg"
+    content_type = "audio/ogg"
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.size = len(content)
+        self.reads = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads += 1
+        return self.content
+
+
+class FakeWhisper:
+    def __init__(self):
+        self.calls = 0
+        self.audio = SimpleNamespace(
+            transcriptions=SimpleNamespace(create=self.create)
+        )
+
+    async def create(self, model, file):
+        self.calls += 1
+        return SimpleNamespace(text=f"transcript {self.calls}")
+
+
+async def test_cached_audio_id_skips_reading_upload():
+    whisper = FakeWhisper()
+    service = TranscriptionService(whisper, TranscriptCache(max_size=10))
+
+    first = FakeUpload(b"voice")
+    assert await service.transcribe(first, "file-1") == "transcript 1"
+    assert first.reads == 1
+
+    # Пересланное голосовое: тот же audio_id, файл не читается и Whisper не вызывается
+    forwarded = FakeUpload(b"voice")
+    assert await service.transcribe(forwarded, "file-1") == "transcript 1"
+    assert forwarded.reads == 0
+    assert whisper.calls == 1
+
+
+async def test_without_audio_id_content_hash_is_the_key():
+    whisper = FakeWhisper()
+    service = TranscriptionService(whisper, TranscriptCache(max_size=10))
+
+    assert await service.transcribe(FakeUpload(b"voice")) == "transcript 1"
+    assert await service.transcribe(FakeUpload(b"voice")) == "transcript 1"
+    assert await service.transcribe(FakeUpload(b"other")) == "transcript 2"